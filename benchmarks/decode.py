@@ -0,0 +1,92 @@
+'''
+Measure how many rows per second each way of reading a full report decodes,
+from a synthetic zipped report in memory (see fakeserver.report_zip), without
+any HTTP. For example:
+
+    python benchmarks/decode.py
+    python benchmarks/decode.py --judgments 500000
+
+'dicts' is what Job.download() does; the others use crowdflower.decoder,
+which also converts the values to integers, floats, booleans, and datetimes.
+'''
+import os
+import sys
+import csv
+import time
+import zipfile
+import argparse
+from cStringIO import StringIO
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+from crowdflower.decoder import decode_report
+from crowdflower.unit import Judgment
+from fakeserver import report_zip
+
+LEGEND = {'sentiment': 'What is the sentiment of this text?'}
+
+
+def members(data):
+    zf = zipfile.ZipFile(StringIO(data))
+    for zipinfo in zf.filelist:
+        yield zf.open(zipinfo)
+
+
+def read_dicts(data):
+    # like Job.download()
+    for fp in members(data):
+        for row in csv.DictReader(fp):
+            yield {key: value.decode('utf8') for key, value in row.items()}
+
+
+def read_records(data):
+    # like Job.download(records=True)
+    schema = Judgment.new_schema()
+    for fp in members(data):
+        reader = csv.reader(fp)
+        header = next(reader)
+        rows = ([value.decode('utf8') for value in row] for row in reader)
+        for judgment in Judgment.from_rows(header, rows, schema):
+            yield judgment
+
+
+def read_csv(data):
+    # the least that any reader must do
+    for fp in members(data):
+        for row in csv.reader(fp):
+            yield row
+
+
+BENCHMARKS = [
+    ('csv.reader (no decoding)', read_csv),
+    ('dicts (Job.download)', read_dicts),
+    ('records', read_records),
+    ('tuples', lambda data: decode_report(members(data), legend=LEGEND)),
+    ('namedtuples', lambda data: decode_report(members(data), legend=LEGEND, namedtuples=True)),
+    ('batches of 1000 tuples', lambda data: (row for batch in decode_report(members(data), legend=LEGEND,
+                                                                             batch_size=1000) for row in batch)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--judgments', type=int, default=100000, help='number of rows in the report')
+    parser.add_argument('--repeat', type=int, default=3, help='report the best of this many runs')
+    opts = parser.parse_args()
+
+    data = report_zip(opts.judgments, opts.judgments // 3)
+    print '%-28s %10s %12s' % ('reader', 'seconds', 'rows/s')
+    for name, func in BENCHMARKS:
+        best = None
+        for _ in range(opts.repeat):
+            started = time.time()
+            rows = sum(1 for _ in func(data))
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print '%-28s %10.3f %12.0f' % (name, best, rows / best)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+'''
+A local stand-in for the CrowdFlower API, serving synthetic jobs, for
+benchmarks. It implements just enough of the API for the client:
+
+    GET  /jobs                  pages of 10 jobs
+    GET  /jobs/{id}             job properties
+    GET  /jobs/{id}/units       pages of 1000 units
+    GET  /jobs/{id}/ping        counts
+    GET  /jobs/{id}/legend      the CML fields of the report
+    GET  /jobs/{id}.csv         zipped full report; responds '202 Accepted'
+                                the first `pending_reports` times
+    POST /jobs                  creates a job
+    POST /jobs/upload           creates a job
+    POST /jobs/{id}/upload      newline-separated JSON (plain or chunked)
+    POST /jobs/{id}/regenerate
+    PUT  /jobs/{id}             updates a job (a no-op)
+    *    /jobs/{id}/tags        (a no-op)
+    POST /jobs/{id}/orders      (a no-op)
+
+Use like:
+
+    server = FakeServer(jobs_count=100, units_count=5000, judgments_count=10000)
+    server.start()
+    conn = crowdflower.Connection(api_key='x' * 20, api_url=server.api_url)
+    ...
+    print server.stats
+    server.stop()
+'''
+import re
+import json
+import time
+import random
+import socket
+import zipfile
+import threading
+import urlparse
+from cStringIO import StringIO
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+REPORT_HEADER = ['_unit_id', '_created_at', '_golden', '_canary', '_id', '_missed', '_started_at',
+                 '_tainted', '_channel', '_trust', '_worker_id', '_country', '_region', '_city', '_ip',
+                 'id', 'text', 'sentiment', 'sentiment_gold']
+CHANNELS = ['neodev', 'clixsense', 'instagc', 'prodege']
+COUNTRIES = ['USA', 'GBR', 'CAN', 'IND', 'PHL', 'DEU']
+SENTIMENTS = ['positive', 'negative', 'neutral']
+
+
+def report_row(index, units_count, judgments_per_unit=3):
+    '''
+    Returns the synthetic row for judgment number `index` of a report.
+    '''
+    rand = random.Random(index)
+    unit = index // judgments_per_unit % max(units_count, 1)
+    created_at = '%d/%d/2015 %02d:%02d:%02d' % (rand.randint(1, 12), rand.randint(1, 28),
+                                               rand.randint(0, 23), rand.randint(0, 59), rand.randint(0, 59))
+    golden = unit % 20 == 0
+    return [
+        str(100000000 + unit), created_at, 'true' if golden else 'false', '', str(200000000 + index), '',
+        created_at, 'false', rand.choice(CHANNELS), '%.4f' % rand.uniform(0.6, 1.0),
+        str(30000000 + rand.randint(0, 500)), rand.choice(COUNTRIES), str(rand.randint(1, 60)),
+        'Springfield', '10.0.%d.%d' % (rand.randint(0, 255), rand.randint(0, 255)),
+        'unit-%d' % unit, '"text of unit %d, with a comma and caf\xc3\xa9"' % unit,
+        rand.choice(SENTIMENTS), rand.choice(SENTIMENTS) if golden else '',
+    ]
+
+
+def report_zip(judgments_count, units_count, members=1):
+    '''
+    Build a zipped full report with `judgments_count` rows, split across
+    `members` CSV files.
+    '''
+    buf = StringIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        per_member = -(-judgments_count // members) if judgments_count else 0
+        for member in range(members):
+            lines = [','.join(REPORT_HEADER)]
+            for index in range(member * per_member, min(judgments_count, (member + 1) * per_member)):
+                lines.append(','.join(report_row(index, units_count)))
+            zf.writestr('job_%d.csv' % member, '\n'.join(lines) + '\n')
+    return buf.getvalue()
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # buffer responses, so that headers and body go out in one write
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return ''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _respond(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+        self.server.fake.count(len(body))
+
+    def _handle(self):
+        fake = self.server.fake
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        body = self._read_body()
+        fake.count(len(body), request=True)
+        if fake.latency:
+            time.sleep(fake.latency)
+        page = int(query.get('page', ['1'])[0])
+        path = url.path[len('/v1'):] if url.path.startswith('/v1') else url.path
+
+        if path == '/jobs' and self.command == 'GET':
+            job_ids = range(1, fake.jobs_count + 1)[(page - 1) * 10:page * 10]
+            return self._respond(200, json.dumps([fake.job_properties(job_id) for job_id in job_ids]))
+        if path in ('/jobs', '/jobs/upload') and self.command == 'POST':
+            return self._respond(200, json.dumps(fake.job_properties(fake.jobs_count + 1)))
+        match = re.match(r'^/jobs/(\d+)(\.csv|/units|/ping|/upload|/regenerate|/tags|/orders|/legend)?$', path)
+        if match is None:
+            return self._respond(404, json.dumps({'error': 'not found'}))
+        job_id, action = int(match.group(1)), match.group(2)
+        if action is None:
+            return self._respond(200, json.dumps(fake.job_properties(job_id)))
+        if action == '/units':
+            start = (page - 1) * 1000
+            units = dict((str(100000000 + index), {'id': 'unit-%d' % index, 'text': 'text of unit %d' % index})
+                         for index in range(start, min(start + 1000, fake.units_count)))
+            return self._respond(200, json.dumps(units))
+        if action == '/ping':
+            return self._respond(200, json.dumps({'all_units': fake.units_count, 'all_judgments': fake.judgments_count,
+                                                  'needed_judgments': 0, 'tainted_judgments': 0}))
+        if action == '/legend':
+            return self._respond(200, json.dumps({'sentiment': 'What is the sentiment of this text?'}))
+        if action == '/upload':
+            units_count = len([line for line in body.split('\n') if line.strip()])
+            return self._respond(200, json.dumps(dict(fake.job_properties(job_id), units_count=units_count)))
+        if action in ('/regenerate', '/tags', '/orders'):
+            return self._respond(200, json.dumps({}))
+        # .csv
+        if fake.take_pending_report():
+            return self._respond(202, json.dumps({}))
+        return self._respond(200, fake.report(), 'application/zip')
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    def __init__(self, jobs_count=10, units_count=1000, judgments_count=3000, report_members=1,
+                 pending_reports=0, latency=0.0):
+        self.jobs_count = jobs_count
+        self.units_count = units_count
+        self.judgments_count = judgments_count
+        self.report_members = report_members
+        self.pending_reports = pending_reports
+        self.latency = latency
+        self.stats = dict(requests=0, bytes_received=0, bytes_sent=0)
+        self._report = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __repr__(self):
+        return '<{:} at {:}>'.format(self.__class__.__name__, self.api_url)
+
+    @property
+    def api_url(self):
+        return 'http://127.0.0.1:%d/v1' % self._server.server_address[1]
+
+    def start(self):
+        # generating the report is slow, so do it before anyone's timing requests
+        self.report()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), FakeRequestHandler)
+        self._server.fake = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = dict(requests=0, bytes_received=0, bytes_sent=0)
+
+    def count(self, nbytes, request=False):
+        with self._lock:
+            if request:
+                self.stats['requests'] += 1
+                self.stats['bytes_received'] += nbytes
+            else:
+                self.stats['bytes_sent'] += nbytes
+
+    def take_pending_report(self):
+        with self._lock:
+            if self.pending_reports > 0:
+                self.pending_reports -= 1
+                return True
+            return False
+
+    def job_properties(self, job_id):
+        return {'id': job_id, 'title': 'Synthetic job %d' % job_id, 'state': 'running',
+                'units_count': self.units_count, 'judgments_count': self.judgments_count}
+
+    def report(self):
+        with self._lock:
+            if self._report is None:
+                self._report = report_zip(self.judgments_count, self.units_count, self.report_members)
+            return self._report
@@ -0,0 +1,103 @@
+'''
+Measure how long `import crowdflower` takes in a fresh interpreter, and
+check that it doesn't import any heavy modules, which should only be
+imported on first use of Connection / Job. For example:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 50 --max-ms 20
+
+Exits with status 1 if the median import time exceeds --max-ms, if any of
+HEAVY_MODULES was imported, or if the lazy imports break any of the ways the
+package used to be imported (see API_SCRIPT), so that it can guard against
+regressions.
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+
+# modules that `import crowdflower` must not import
+HEAVY_MODULES = ['pkg_resources', 'requests', 'numpy', 'crowdflower.connection', 'crowdflower.job',
+                 'csv', 'zipfile', 'sqlite3']
+
+# run in a fresh interpreter, so that nothing is imported already
+SCRIPT = '''
+import sys, json, time
+sys.path.insert(0, %r)
+started = time.time()
+import crowdflower
+elapsed = time.time() - started
+print json.dumps(dict(seconds=elapsed, modules=[name for name in %r if name in sys.modules]))
+'''
+
+
+# check that the lazy crowdflower module still works like the eager one did
+API_SCRIPT = '''
+import sys, json
+sys.path.insert(0, %r)
+problems = []
+namespace = dict()
+exec 'from crowdflower import *' in namespace
+for name in ['Connection', 'Job', 'logger', 'exception', 'connection']:
+    if name not in namespace:
+        problems.append('from crowdflower import * does not import %%s' %% name)
+for name in ['LazyModule', 'ModuleType', 'sys', 'LAZY_ATTRIBUTES']:
+    if name in namespace:
+        problems.append('from crowdflower import * leaks %%s' %% name)
+import crowdflower
+for name in ['exception', 'cache', 'serialization', 'Connection', 'Job']:
+    try:
+        getattr(crowdflower, name)
+    except AttributeError:
+        problems.append('crowdflower.%%s is missing' %% name)
+if hasattr(crowdflower, 'no_such_module'):
+    problems.append('crowdflower.no_such_module exists')
+print json.dumps(problems)
+'''
+
+
+def check_api():
+    return json.loads(subprocess.check_output([sys.executable, '-c', API_SCRIPT % root]))
+
+
+def measure():
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT % (root, HEAVY_MODULES)])
+    return json.loads(output)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='number of fresh interpreters to time')
+    parser.add_argument('--max-ms', type=float, default=25.0, help='maximum median import time (milliseconds)')
+    opts = parser.parse_args()
+
+    results = [measure() for _ in range(opts.repeat)]
+    seconds = [result['seconds'] for result in results]
+    print 'import crowdflower: median %.1f ms, min %.1f ms, max %.1f ms (%d runs)' % (
+        median(seconds) * 1000, min(seconds) * 1000, max(seconds) * 1000, len(seconds))
+
+    failed = False
+    if median(seconds) * 1000 > opts.max_ms:
+        print 'FAIL: median import time exceeds %.1f ms' % opts.max_ms
+        failed = True
+    heavy = sorted(set(name for result in results for name in result['modules']))
+    if heavy:
+        print 'FAIL: import crowdflower imported %s' % ', '.join(heavy)
+        failed = True
+    for problem in check_api():
+        print 'FAIL: %s' % problem
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+'''
+Measure the client's throughput against a local fake CrowdFlower API server
+(see fakeserver.py), for synthetic jobs of a few sizes. For example:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --sizes small,large --only download,units
+    python benchmarks/run.py --latency 0.05 --json results.json
+
+Each benchmark runs in its own process, so that its peak RSS can be measured.
+For each, the output reports the number of requests per second, the
+megabytes per second sent and received by the server, and the number of
+rows (jobs, units, or judgments) per second.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+from crowdflower import Connection
+from crowdflower.cache import MemoryCache, FilesystemCache, SQLiteCache, TwoLevelCache
+from fakeserver import FakeServer
+
+
+SIZES = {
+    'small': dict(jobs_count=50, units_count=5000, judgments_count=15000),
+    'medium': dict(jobs_count=500, units_count=50000, judgments_count=150000),
+    'large': dict(jobs_count=2000, units_count=500000, judgments_count=1500000),
+}
+
+CACHES = {
+    'memory': lambda dirpath: MemoryCache(),
+    'filesystem': lambda dirpath: FilesystemCache(dirpath),
+    'sqlite': lambda dirpath: SQLiteCache(os.path.join(dirpath, 'cache.sqlite')),
+    'memory+filesystem': lambda dirpath: TwoLevelCache(MemoryCache(), FilesystemCache(dirpath)),
+}
+
+
+def synthetic_units(count):
+    for index in range(count):
+        yield {'id': 'unit-%d' % index, 'text': 'text of synthetic unit %d' % index}
+
+
+def count(iterable):
+    total = 0
+    for _ in iterable:
+        total += 1
+    return total
+
+
+def bench_job_ids(conn, server):
+    return count(conn.job_ids)
+
+
+def bench_units(conn, server):
+    return count(conn.job(1).iter_units())
+
+
+def bench_units_threads(conn, server):
+    return count(conn.job(1).iter_units(threads=8))
+
+
+def bench_upload(conn, server):
+    conn.job(1).upload(synthetic_units(server.units_count))
+    return server.units_count
+
+
+def bench_upload_stream(conn, server):
+    conn.job(1).upload(synthetic_units(server.units_count), stream=True)
+    return server.units_count
+
+
+def bench_upload_batches(conn, server):
+    return conn.job(1).upload_batches(synthetic_units(server.units_count), batch_bytes=256 * 1024, threads=4)['units_count']
+
+
+def bench_download(conn, server):
+    return count(conn.job(1).download())
+
+
+def bench_download_processes(conn, server):
+    return count(conn.job(1).download(processes=4))
+
+
+def bench_decode_report(conn, server):
+    return count(conn.job(1).decode_report())
+
+
+def bench_decode_report_processes(conn, server):
+    return count(conn.job(1).decode_report(processes=4))
+
+
+def bench_download_list(conn, server):
+    return len(list(conn.job(1).download()))
+
+
+def bench_download_records(conn, server):
+    return len(list(conn.job(1).download(records=True)))
+
+
+def bench_download_wait(conn, server):
+    job = conn.job(1)
+    job.REPORT_BACKOFF = dict(initial=0.05, maximum=0.2, factor=2.0, jitter=0.5)
+    return count(job.download(wait=60))
+
+
+def bench_judgments_table(conn, server):
+    return len(conn.job(1).judgments_table())
+
+
+def bench_cache_miss(conn, server):
+    return len(conn.job(1).units)
+
+
+def bench_cache_hit(conn, server):
+    return sum(len(conn.job(1).units) for _ in range(5))
+
+
+def warm_cache(conn, server):
+    conn.job(1).units
+
+
+BENCHMARKS = [
+    # (name, function, setup, cache, server attributes)
+    ('job_ids', bench_job_ids, None, None, {}),
+    ('units', bench_units, None, None, {}),
+    ('units threads=8', bench_units_threads, None, None, {}),
+    ('upload', bench_upload, None, None, {}),
+    ('upload stream', bench_upload_stream, None, None, {}),
+    ('upload_batches threads=4', bench_upload_batches, None, None, {}),
+    ('download', bench_download, None, None, {}),
+    ('download processes=4', bench_download_processes, None, None, {}),
+    ('decode_report', bench_decode_report, None, None, {}),
+    ('decode_report processes=4', bench_decode_report_processes, None, None, {}),
+    ('download into list', bench_download_list, None, None, {}),
+    ('download records into list', bench_download_records, None, None, {}),
+    ('download wait (202, 202, 200)', bench_download_wait, None, None, dict(pending_reports=2)),
+    ('judgments_table', bench_judgments_table, None, None, {}),
+]
+for cache_name in sorted(CACHES):
+    BENCHMARKS.append(('units cache=%s miss' % cache_name, bench_cache_miss, None, cache_name, {}))
+    BENCHMARKS.append(('units cache=%s hit x5' % cache_name, bench_cache_hit, warm_cache, cache_name, {}))
+
+
+def _child(server, func, setup, cache_name, queue, go):
+    dirpath = tempfile.mkdtemp(prefix='crowdflower-bench-')
+    try:
+        cache = CACHES[cache_name](dirpath) if cache_name else None
+        conn = Connection(cache=cache, api_key='x' * 20, api_url=server.api_url)
+        if setup is not None:
+            setup(conn, server)
+        # wait for the parent to reset the server's stats
+        queue.put('ready')
+        go.wait()
+        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.time()
+        rows = func(conn, server)
+        elapsed = time.time() - started
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put(dict(rows=rows, seconds=elapsed, peak_rss_kb=peak_rss, rss_growth_kb=peak_rss - start_rss))
+    except Exception, exc:
+        queue.put(dict(error=repr(exc)))
+    finally:
+        shutil.rmtree(dirpath, ignore_errors=True)
+
+
+def run(server, func, setup, cache_name, server_attrs):
+    '''
+    Run one benchmark in a child process, and return its measurements.
+
+    `server_attrs` are set on the server (which runs in this process) just
+    before the benchmark starts.
+    '''
+    queue = multiprocessing.Queue()
+    go = multiprocessing.Event()
+    process = multiprocessing.Process(target=_child, args=(server, func, setup, cache_name, queue, go))
+    process.start()
+    message = queue.get()
+    if message == 'ready':
+        # don't count the setup's requests
+        server.reset_stats()
+        for key, value in server_attrs.items():
+            setattr(server, key, value)
+        go.set()
+        message = queue.get()
+    process.join()
+    result = message
+    if 'error' in result:
+        return result
+    stats = dict(server.stats)
+    seconds = max(result['seconds'], 1e-9)
+    result.update(stats)
+    result['requests_per_second'] = stats['requests'] / seconds
+    result['mb_per_second'] = (stats['bytes_sent'] + stats['bytes_received']) / seconds / 1e6
+    result['rows_per_second'] = result['rows'] / seconds
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='small,medium', help='comma-separated: %s' % ', '.join(sorted(SIZES)))
+    parser.add_argument('--only', help='comma-separated substrings of benchmark names to run')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server waits before each response')
+    parser.add_argument('--json', help='also write the results to this file')
+    opts = parser.parse_args()
+
+    results = []
+    columns = '%-36s %-7s %9s %8s %10s %9s %12s %9s'
+    print columns % ('benchmark', 'size', 'seconds', 'requests', 'requests/s', 'MB/s', 'rows/s', 'peak RSS')
+    for size in opts.sizes.split(','):
+        server = FakeServer(latency=opts.latency, **SIZES[size]).start()
+        for name, func, setup, cache_name, server_attrs in BENCHMARKS:
+            if opts.only and not any(only in name for only in opts.only.split(',')):
+                continue
+            result = run(server, func, setup, cache_name, server_attrs)
+            result.update(benchmark=name, size=size)
+            results.append(result)
+            if 'error' in result:
+                print '%-36s %-7s %s' % (name, size, result['error'])
+                continue
+            print columns % (name, size, '%.3f' % result['seconds'], result['requests'],
+                             '%.1f' % result['requests_per_second'], '%.2f' % result['mb_per_second'],
+                             '%.0f' % result['rows_per_second'], '%.1f MB' % (result['peak_rss_kb'] / 1024.0))
+            sys.stdout.flush()
+        server.stop()
+
+    if opts.json:
+        with open(opts.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+Microbenchmark the Rails-style parameter encoders on job settings with
+deeply nested `options`. For example:
+
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --depth 8 --width 3 --number 5
+'''
+import os
+import sys
+import json
+import timeit
+import argparse
+from urllib import urlencode
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from crowdflower.serialization import rails_params, rails_form
+
+
+def nested_options(depth, width):
+    if depth == 0:
+        return ['leaf value %d' % index for index in range(width)]
+    return dict(('option_%d' % index, nested_options(depth - 1, width)) for index in range(width))
+
+
+def job_settings(depth, width):
+    return {'job': {
+        'title': 'Sentiment of tweets',
+        'cml': '<cml:radios label="Sentiment" name="sentiment" validates="required">'
+               '<cml:radio label="Positive" value="positive"/></cml:radios>\n' * 50,
+        'css': '.cml label { font-weight: bold; }\n' * 50,
+        'js': 'require(["jquery"], function($) { $(".cml").show(); });\n' * 50,
+        'instructions': '<p>Read each tweet and choose its sentiment.</p>\n' * 50,
+        'options': nested_options(depth, width),
+    }}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=5, help='nesting depth of the options')
+    parser.add_argument('--width', type=int, default=4, help='number of keys at each level of the options')
+    parser.add_argument('--number', type=int, default=20, help='number of times to encode the settings')
+    opts = parser.parse_args()
+
+    params = job_settings(opts.depth, opts.width)
+    pairs = list(rails_params(params))
+    assert rails_form(params) == urlencode([(key, value) for key, value in pairs if value is not None])
+    print '%d parameters, %d bytes form-encoded' % (len(pairs), len(rails_form(params)))
+
+    benchmarks = [
+        ('rails_params', lambda: list(rails_params(params))),
+        ('rails_params + urlencode', lambda: urlencode(list(rails_params(params)))),
+        ('rails_form', lambda: rails_form(params)),
+        ('json.dumps', lambda: json.dumps(params)),
+    ]
+    for name, func in benchmarks:
+        seconds = min(timeit.repeat(func, number=opts.number, repeat=3)) / opts.number
+        print '%-36s %9.3f ms' % (name, seconds * 1000)
+
+
+if __name__ == '__main__':
+    main()
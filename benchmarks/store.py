@@ -0,0 +1,78 @@
+'''
+Compare looking up the judgments of single units and workers in a
+crowdflower.mmapstore.MappedJudgmentStore with loading the report and scanning
+it, from a synthetic zipped report (see fakeserver.report_zip), without any
+HTTP. For example:
+
+    python benchmarks/store.py
+    python benchmarks/store.py --judgments 500000 --lookups 1000
+'''
+import os
+import sys
+import csv
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+from cStringIO import StringIO
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+from crowdflower.mmapstore import MappedJudgmentStore
+from fakeserver import report_zip
+
+
+def read_dicts(data):
+    # like Job.download()
+    zf = zipfile.ZipFile(StringIO(data))
+    for zipinfo in zf.filelist:
+        for row in csv.DictReader(zf.open(zipinfo)):
+            yield {key: value.decode('utf8') for key, value in row.items()}
+
+
+def timed(func):
+    started = time.time()
+    result = func()
+    return result, time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--judgments', type=int, default=100000, help='number of rows in the report')
+    parser.add_argument('--lookups', type=int, default=200, help='number of units and of workers to look up')
+    opts = parser.parse_args()
+
+    data = report_zip(opts.judgments, opts.judgments // 3)
+    tempdir = tempfile.mkdtemp(prefix='crowdflower-bench-')
+    try:
+        dirpath = os.path.join(tempdir, 'store')
+        _, build = timed(lambda: MappedJudgmentStore.build(dirpath, read_dicts(data)))
+        store, open_ = timed(lambda: MappedJudgmentStore(dirpath))
+        rows, load = timed(lambda: list(read_dicts(data)))
+        units = random.sample(sorted(set(row['_unit_id'] for row in rows)), opts.lookups)
+        workers = random.sample(sorted(set(row['_worker_id'] for row in rows)), opts.lookups)
+        _, store_units = timed(lambda: [store.unit(unit_id) for unit_id in units])
+        _, store_workers = timed(lambda: [store.worker(worker_id) for worker_id in workers])
+        # a single scan of the loaded rows, for comparison
+        _, scan = timed(lambda: [row for row in rows if row['_unit_id'] == units[0]])
+        _, trusts = timed(lambda: sum(1 for _ in store.column('_trust')))
+        size = sum(os.path.getsize(os.path.join(dirpath, name)) for name in os.listdir(dirpath))
+
+        print 'store: %d judgments, %.1f MB on disk' % (len(store), size / 1e6)
+        print '%-32s %10.3f s' % ('build', build)
+        print '%-32s %10.3f ms' % ('open', open_ * 1000)
+        print '%-32s %10.3f s' % ('load report into dicts', load)
+        print '%-32s %10.3f ms' % ('scan dicts for one unit', scan * 1000)
+        print '%-32s %10.3f ms' % ('store.unit() per lookup', store_units / opts.lookups * 1000)
+        print '%-32s %10.3f ms' % ('store.worker() per lookup', store_workers / opts.lookups * 1000)
+        print '%-32s %10.0f rows/s' % ('store.column(\'_trust\')', len(store) / trusts)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,67 @@
 import os
+import imp
+import sys
+from types import ModuleType
 # here is the directory containing this __init__.py file
 here = os.path.dirname(__file__) or os.curdir
 # root is the directory containing `here`, i.e., the directory containing setup.py
 root = os.path.dirname(os.path.abspath(here))
 
 
-import pkg_resources
-__version__ = pkg_resources.get_distribution('crowdflower').version
+# setup.py reads the version from here, so keep it on a line of its own
+__version__ = '0.1.5'
 
 
 import logging
 logger = logging.getLogger('crowdflower')
 
 
-# import helper
-from connection import Connection
+# import helpers: these pull in requests (and much more), so they are only
+# imported when first accessed, e.g., by `from crowdflower import Connection`
+LAZY_ATTRIBUTES = {
+    'Connection': 'crowdflower.connection',
+    'Job': 'crowdflower.job',
+}
+
+# what `from crowdflower import *` imports (importing Connection and Job,
+# and the submodules that importing Connection used to bring along)
+__all__ = ['Connection', 'Job', 'logger', 'here', 'root',
+           'cache', 'connection', 'exception', 'job', 'serialization']
+
+
+class LazyModule(ModuleType):
+    '''
+    A module that imports the attributes named in LAZY_ATTRIBUTES from their
+    modules, and its submodules (e.g., crowdflower.exception), when they are
+    first accessed. Python 2 modules can't define __getattr__, so this
+    replaces the crowdflower module in sys.modules.
+    '''
+    def __getattr__(self, name):
+        if name in LAZY_ATTRIBUTES:
+            __import__(LAZY_ATTRIBUTES[name])
+            value = getattr(sys.modules[LAZY_ATTRIBUTES[name]], name)
+            setattr(self, name, value)
+            return value
+        if not name.startswith('_'):
+            try:
+                # only look for the file, so that import errors inside the
+                # submodule are raised as they are
+                imp.find_module(name, self.__path__)
+            except ImportError:
+                pass
+            else:
+                __import__('%s.%s' % (self.__name__, name))
+                # importing a submodule sets it as an attribute
+                return self.__dict__[name]
+        raise AttributeError("'module' object has no attribute '%s'" % name)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(LAZY_ATTRIBUTES))
+
+
+_module = LazyModule(__name__, __doc__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+# keep the original module alive, since Python 2 clears a module's globals
+# (which LazyModule's methods use) when it is garbage collected
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+from crowdflower.table import np, Categorical, JudgmentsTable
+
+
+def aggregate(table, fields, min_trust=None, exclude_workers=None):
+    '''
+    Compute per-unit aggregated answers from a JudgmentsTable of full
+    judgments (see Job.judgments_table()), like the 'aggregated' report, but
+    locally, vectorized over the whole job.
+
+    Judgments with a _trust below `min_trust` (or none at all), or by any of
+    the workers in `exclude_workers`, are ignored, as are blank answers. Returns a
+    JudgmentsTable with one row per unit and these columns:
+
+        _unit_id
+        _trusted_judgments
+            the number of judgments of the unit that were counted
+        {field}
+            the answer with the highest total trust, as a Categorical
+            (blank if no judgment of the unit answered the field)
+        {field}:confidence
+            the total trust of that answer, over the total trust of all answers
+        {field}:agreement
+            the fraction of the unit's answers to the field that agree with it
+
+    The table must include the _unit_id and _trust columns (and _worker_id,
+    to exclude workers), and the `fields` columns, which are best read as
+    Categoricals (others are dictionary-encoded here).
+    '''
+    if np is None:
+        raise ImportError('aggregate requires numpy; install it with `pip install numpy`')
+    # a missing trust would make its unit's confidence NaN
+    mask = ~np.isnan(table['_trust'])
+    if min_trust is not None:
+        mask &= table['_trust'] >= min_trust
+    if exclude_workers:
+        mask &= ~np.in1d(table['_worker_id'], list(exclude_workers))
+
+    units, unit_index = np.unique(table['_unit_id'][mask], return_inverse=True)
+    trust = table['_trust'][mask]
+    columns = OrderedDict()
+    columns['_unit_id'] = units
+    columns['_trusted_judgments'] = np.bincount(unit_index, minlength=len(units))
+
+    for field in fields:
+        column = table[field]
+        if not isinstance(column, Categorical):
+            distinct, codes = np.unique(column, return_inverse=True)
+            column = Categorical(codes, list(distinct))
+        categories = list(column.categories)
+        if u'' not in categories:
+            categories.append(u'')
+        blank_code = categories.index(u'')
+        codes = column.codes[mask]
+        answered = codes != blank_code
+        field_unit_index = unit_index[answered]
+        field_codes = codes[answered].astype(np.int64)
+        field_trust = trust[answered]
+
+        # sum trust and count judgments for each distinct (unit, answer) pair
+        pairs, pair_index = np.unique(field_unit_index * len(categories) + field_codes, return_inverse=True)
+        pair_unit = pairs // len(categories)
+        pair_code = pairs % len(categories)
+        pair_trust = np.bincount(pair_index, weights=field_trust)
+        pair_count = np.bincount(pair_index).astype(np.float64)
+        unit_trust = np.bincount(pair_unit, weights=pair_trust, minlength=len(units))
+        unit_count = np.bincount(pair_unit, weights=pair_count, minlength=len(units))
+
+        # the first pair of each unit, when sorted by unit and then descending trust
+        order = np.lexsort((-pair_trust, pair_unit))
+        sorted_unit = pair_unit[order]
+        best = order[np.concatenate(([True], sorted_unit[1:] != sorted_unit[:-1]))] if len(order) else order
+        best_unit = pair_unit[best]
+
+        answers = np.empty(len(units), dtype=np.int32)
+        answers.fill(blank_code)
+        answers[best_unit] = pair_code[best]
+        confidence = np.empty(len(units))
+        confidence.fill(np.nan)
+        agreement = confidence.copy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            confidence[best_unit] = pair_trust[best] / unit_trust[best_unit]
+            agreement[best_unit] = pair_count[best] / unit_count[best_unit]
+
+        columns[field] = Categorical(answers, categories)
+        columns[field + ':confidence'] = confidence
+        columns[field + ':agreement'] = agreement
+
+    return JudgmentsTable(columns)
@@ -0,0 +1,297 @@
+import sys
+import threading
+from Queue import Queue, Full
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+
+from crowdflower.connection import Connection
+from crowdflower.job import Job
+
+
+def _submitter(name):
+    '''
+    Create an AsyncJob method that calls the Job method (or reads the Job
+    property) called `name` in the connection's thread pool.
+    '''
+    def method(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+
+        def call():
+            value = getattr(self._job, name)
+            if callable(value):
+                value = value(*args, **kwargs)
+            if isinstance(value, Job):
+                value = AsyncJob(value.id, self._connection)
+            return value
+        return self._connection._submit(call, callback=callback)
+    method.__name__ = name
+    method.__doc__ = getattr(Job, name).__doc__
+    return method
+
+
+def _streamer(name):
+    '''
+    Create an AsyncJob method that iterates over the Job method (a generator)
+    called `name` in a thread of its own, and returns an AsyncIterator over
+    its items.
+    '''
+    def method(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        buffer_size = kwargs.pop('buffer_size', self._connection.BUFFER_SIZE)
+        return AsyncIterator(lambda: getattr(self._job, name)(*args, **kwargs), buffer_size, callback)
+    method.__name__ = name
+    method.__doc__ = getattr(Job, name).__doc__
+    return method
+
+
+# kinds of entries in an AsyncIterator's queue
+_ITEM, _ERROR, _DONE = range(3)
+# seconds between a blocked producer's checks for whether to stop
+POLL_INTERVAL = 0.1
+
+
+def _put(queue, stopped, entry):
+    # returns False if the producer was stopped while waiting for room
+    while not stopped.is_set():
+        try:
+            queue.put(entry, timeout=POLL_INTERVAL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _produce(queue, stopped, done, generate, callback):
+    # runs in the producer thread, and holds no reference to the
+    # AsyncIterator, so that an abandoned iterator can be collected
+    iterable = None
+    try:
+        iterable = generate()
+        for item in iterable:
+            if stopped.is_set():
+                return
+            if callback is not None:
+                callback(item)
+            elif not _put(queue, stopped, (_ITEM, item)):
+                return
+    except Exception:
+        _put(queue, stopped, (_ERROR, sys.exc_info()))
+    else:
+        _put(queue, stopped, (_DONE, None))
+    finally:
+        try:
+            if hasattr(iterable, 'close'):
+                # e.g., close the downloaded report's temporary file
+                iterable.close()
+        finally:
+            done.set()
+
+
+class AsyncIterator(object):
+    '''
+    The result of a paginated or streaming AsyncJob method (iter_units,
+    download, iter_judgments, decode_report): the items are produced in a
+    thread of its own (not one of the connection's pool, so that streams
+    never hold up other calls) into a queue of at most `buffer_size` items,
+    so memory use stays flat however large the report, and consumed by
+    iterating:
+
+        rows = job.download()
+        for row in rows:
+            print row
+
+    next(timeout=...) raises Queue.Empty if no item arrives in time. Any error
+    in the producer is raised when it is reached. If a `callback` is given,
+    each item is passed to it in the producer thread instead of being
+    queued; wait() waits for the end, and iterating only raises any error.
+
+    close() stops the producer (at the next item) and discards what was
+    buffered; so does dropping the last reference to the iterator, unless it
+    has a callback.
+    '''
+    def __init__(self, generate, buffer_size, callback=None):
+        self.buffer_size = buffer_size
+        self._queue = Queue(maxsize=buffer_size)
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+        self._finished = False
+        self._callback = callback
+        self._thread = threading.Thread(target=_produce,
+                                        args=(self._queue, self._stopped, self._done, generate, callback))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return '<{:} buffering {:}/{:}>'.format(self.__class__.__name__, self._queue.qsize(), self.buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # an abandoned iterator's producer would otherwise wait for room in
+        # the queue forever; with a callback, nothing waits for it
+        if self._callback is None:
+            self._stopped.set()
+
+    def __iter__(self):
+        return self
+
+    def next(self, timeout=None):
+        if self._finished:
+            raise StopIteration
+        if timeout is None:
+            kind, value = self._queue.get()
+        else:
+            kind, value = self._queue.get(timeout=timeout)
+        if kind == _DONE:
+            self._finished = True
+            raise StopIteration
+        if kind == _ERROR:
+            self._finished = True
+            raise value[0], value[1], value[2]
+        return value
+
+    def ready(self):
+        '''
+        Whether the producer is done (with all of its items queued).
+        '''
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+
+    def close(self):
+        self._finished = True
+        self._stopped.set()
+
+
+class AsyncConnection(object):
+    '''
+    A non-blocking wrapper around Connection: every API call is sent from a
+    bounded pool of worker threads, and returns immediately with a
+    multiprocessing.pool.AsyncResult, which supports .get(timeout=None),
+    .wait(timeout=None), and .ready().
+
+        conn = AsyncConnection(api_key='...', pool_size=20)
+        pings = [job.ping() for job in map(conn.job, job_ids)]
+        for result in pings:
+            print result.get()
+
+    The underlying requests.Session keeps at most `pool_size` HTTP connections
+    open, and blocks rather than opening more, so that no more than
+    `pool_size` requests are in flight at once.
+
+    The generator methods of Job (iter_units, download, iter_judgments,
+    decode_report) instead return an AsyncIterator, which is fed from a
+    thread of its own, at most BUFFER_SIZE items ahead of the consumer. job_ids, jobs, and the Job
+    properties (units, judgments) resolve to complete lists.
+    '''
+    # default number of items that an AsyncIterator buffers
+    BUFFER_SIZE = 1000
+
+    def __init__(self, cache=None, api_key=Connection.DEFAULT_API_KEY,
+                 api_url=Connection.DEFAULT_API_URL, policy=None, revalidate=False, pool_size=10, connection=None,
+                 metrics=None, params_encoding='query'):
+        if connection is None:
+            connection = Connection(cache=cache, api_key=api_key, api_url=api_url, policy=policy, revalidate=revalidate,
+                                    metrics=metrics, params_encoding=params_encoding)
+        self.connection = connection
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.connection._session.mount('http://', adapter)
+        self.connection._session.mount('https://', adapter)
+        self._pool = ThreadPool(pool_size)
+
+    def __repr__(self):
+        return '<{:} with pool of {:} around {!r}>'.format(self.__class__.__name__, self.pool_size, self.connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Wait for all pending requests to finish, and stop the worker threads.
+        '''
+        self._pool.close()
+        self._pool.join()
+
+    def _submit(self, func, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        return self._pool.apply_async(func, args, kwargs, callback=callback)
+
+    def request(self, path, method='GET', params=None, headers=None, data=None, callback=None):
+        return self._submit(self.connection.request, path, method=method, params=params,
+                            headers=headers, data=data, callback=callback)
+
+    def job(self, job_id):
+        # doesn't actually call anything
+        return AsyncJob(job_id, self)
+
+    def job_ids(self, callback=None):
+        return self._submit(lambda: list(self.connection.job_ids), callback=callback)
+
+    def jobs(self, callback=None):
+        return self._submit(lambda: [AsyncJob(job_id, self) for job_id in self.connection.job_ids],
+                            callback=callback)
+
+    def create_job(self, props, callback=None):
+        return self._submit(lambda: AsyncJob(self.connection.create_job(props).id, self), callback=callback)
+
+    def upload(self, units, callback=None):
+        return self._submit(lambda: AsyncJob(self.connection.upload(units).id, self), callback=callback)
+
+    def account(self, callback=None):
+        return self._submit(self.connection.account, callback=callback)
+
+
+class AsyncJob(object):
+    '''
+    The non-blocking counterpart of Job; see AsyncConnection.
+
+    Each method takes the same arguments as the Job method of the same name,
+    plus an optional `callback`, and returns an AsyncResult, or an
+    AsyncIterator for generators (which also take `buffer_size`). Properties
+    of Job (properties, tags, units, judgments) are methods here.
+    '''
+    def __init__(self, job_id, connection):
+        self.id = job_id
+        self._connection = connection
+        self._job = Job(job_id, connection.connection)
+
+    def __repr__(self):
+        return '<{:} {:}>'.format(self.__class__.__name__, self.id)
+
+    properties = _submitter('properties')
+    tags = _submitter('tags')
+    set_tags = _submitter('set_tags')
+    add_tags = _submitter('add_tags')
+    units = _submitter('units')
+    iter_units = _streamer('iter_units')
+    delete_unit = _submitter('delete_unit')
+    upload_unit = _submitter('upload_unit')
+    upload = _submitter('upload')
+    upload_batches = _submitter('upload_batches')
+    update = _submitter('update')
+    channels = _submitter('channels')
+    legend = _submitter('legend')
+    gold_reset = _submitter('gold_reset')
+    gold_add = _submitter('gold_add')
+    launch = _submitter('launch')
+    cancel = _submitter('cancel')
+    ping = _submitter('ping')
+    delete = _submitter('delete')
+    copy = _submitter('copy')
+    download = _streamer('download')
+    judgments = _submitter('judgments')
+    judgments_table = _submitter('judgments_table')
+    aggregate_judgments = _submitter('aggregate_judgments')
+    iter_judgments = _streamer('iter_judgments')
+    decode_report = _streamer('decode_report')
+    download_csv = _submitter('download_csv')
+    regenerate = _submitter('regenerate')
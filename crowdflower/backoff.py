@@ -0,0 +1,16 @@
+import random
+
+
+def delays(initial=1.0, maximum=60.0, factor=2.0, jitter=0.5):
+    '''
+    Generate an endless sequence of delays (in seconds) for exponential backoff.
+
+    The base delay starts at `initial` and is multiplied by `factor` after
+    each step, up to `maximum`. Each delay is then randomized by up to
+    `jitter` (a fraction of the base delay) in either direction, so that
+    many clients backing off at the same time do not retry in lockstep.
+    '''
+    delay = initial
+    while True:
+        yield delay * (1 + random.uniform(-jitter, jitter))
+        delay = min(delay * factor, maximum)
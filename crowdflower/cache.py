@@ -1,7 +1,13 @@
 import os
 import re
 import json
+import time
+import random
+import sqlite3
+import tempfile
+import threading
 import unicodedata
+from collections import OrderedDict
 from crowdflower import logger
 
 
@@ -40,7 +46,14 @@ def keyfunc(instance, func_attr):
     return '%s[%s].%s' % (instance.__class__.__name__, ':'.join(map(str, cache_key_values)), func_attr)
 
 
-def cacheable(name=None):
+def _emit_cache_event(instance, func_attr, result, started):
+    metrics = getattr(instance, 'metrics', None)
+    if metrics is not None:
+        family = '%s.%s' % (instance.__class__.__name__, func_attr)
+        metrics(dict(type='cache', family=family, result=result, latency=time.time() - started))
+
+
+def cacheable(name=None, stream=False, revalidate=False):
     '''An object method decorator. Use like:
 
     class User(object):
@@ -64,12 +77,47 @@ def cacheable(name=None):
         tags = property(get_tags)
 
     The class it is used in must have a `_cache_key_attrs` attribute and a `_cache` Cache instance.
+
+    With stream=True, the decorated method must return an iterable, and the
+    wrapper always returns an iterator: on a cache miss, each item is written
+    to the cache as it is yielded (see AbstractCache.put_stream), and on a
+    hit, items are read back lazily (see AbstractCache.get_stream).
+
+    With revalidate=True, if the instance's `revalidate` attribute is true,
+    the cached value is never used: the method is always called, and its
+    result is written to the cache. This is meant for methods whose requests
+    are revalidated with HTTP conditional requests (see Connection).
+
+    If the instance has a `metrics` sink (see Connection), a 'cache' event is
+    sent to it for each call, with the result ('hit', 'miss', or 'revalidate')
+    and latency (for streams, only of the lookup).
     '''
     def decorator(func):
         func_attr = name or func.__name__
+        if stream:
+            def wrapper(self, *args, **kwargs):
+                started = time.time()
+                key = keyfunc(self, func_attr)
+                values = None
+                result = 'revalidate'
+                if not (revalidate and self.revalidate):
+                    values = self._cache.get_stream(key)
+                    result = 'miss' if values is None else 'hit'
+                _emit_cache_event(self, func_attr, result, started)
+                if values is None:
+                    logger.info('cache miss; streaming "%s" into cache', key)
+                    return self._cache.put_stream(key, func(self, *args, **kwargs))
+                logger.info('cache hit; streaming "%s" from cache', key)
+                return values
+            return wrapper
         def wrapper(self, *args, **kwargs):
+            started = time.time()
             key = keyfunc(self, func_attr)
-            value = self._cache.get(key)
+            value = None
+            result = 'revalidate'
+            if not (revalidate and self.revalidate):
+                value = self._cache.get(key)
+                result = 'miss' if value is None else 'hit'
             if value is None:
                 logger.info('cache miss; fetching "%s" and writing to cache', key)
                 # self refers to the instance, which SHOULD have a ._cache attribute
@@ -78,6 +126,7 @@ def cacheable(name=None):
                 self._cache.put(key, value)
             else:
                 logger.info('cache hit; reading "%s" from cache', key)
+            _emit_cache_event(self, func_attr, result, started)
             return value
         return wrapper
     return decorator
@@ -96,6 +145,31 @@ class AbstractCache(object):
     def removeAll(self):
         raise NotImplementedError
 
+    def get_stream(self, key):
+        '''
+        Returns an iterator over the items in the list stored at `key`, or
+        None if there is no such entry.
+
+        Subclasses that can read entries incrementally should override this.
+        '''
+        value = self.get(key)
+        if value is not None:
+            return iter(value)
+
+    def put_stream(self, key, values):
+        '''
+        Returns a generator that yields each item in `values`, and stores the
+        whole list at `key` once `values` has been exhausted. Nothing is
+        stored if iteration is abandoned or fails.
+
+        Subclasses that can write entries incrementally should override this.
+        '''
+        items = []
+        for value in values:
+            items.append(value)
+            yield value
+        self.put(key, items)
+
 
 class NoCache(AbstractCache):
     def get(self, key):
@@ -104,6 +178,9 @@ class NoCache(AbstractCache):
     def put(self, key, value):
         pass
 
+    def put_stream(self, key, values):
+        return iter(values)
+
     def remove(self, key):
         pass
 
@@ -118,8 +195,8 @@ class FilesystemCache(AbstractCache):
             # this should rightly fail if dirpath is a file, or cannot be accessed
             os.makedirs(dirpath)
 
-    def _filename(self, key):
-        return os.path.join(self.dirpath, clean_filename(key)) + '.json'
+    def _filename(self, key, ext='.json'):
+        return os.path.join(self.dirpath, clean_filename(key)) + ext
 
     def get(self, key):
         filepath = self._filename(key)
@@ -133,11 +210,331 @@ class FilesystemCache(AbstractCache):
             json.dump(value, fp)
 
     def remove(self, key):
-        filepath = self._filename(key)
+        for ext in ('.json', '.jsonl'):
+            filepath = self._filename(key, ext)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def get_stream(self, key):
+        '''
+        Streamed entries are stored as JSON lines, in a .jsonl file, which is
+        read one line at a time. Falls back to a regular (.json) entry.
+        '''
+        filepath = self._filename(key, '.jsonl')
         if os.path.exists(filepath):
-            os.remove(filepath)
+            # open it now, so that a concurrent remove() can't turn a hit into an error
+            return self._read_lines(open(filepath))
+        return super(FilesystemCache, self).get_stream(key)
+
+    def _read_lines(self, fp):
+        with fp:
+            for line in fp:
+                yield json.loads(line)
+
+    def put_stream(self, key, values):
+        '''
+        Items are written to a temporary file as they are yielded, which is
+        renamed to the entry's .jsonl file (atomically) only when `values` has
+        been exhausted.
+        '''
+        fp = tempfile.NamedTemporaryFile(dir=self.dirpath, prefix='.', suffix='.jsonl.tmp', delete=False)
+        try:
+            with fp:
+                for value in values:
+                    fp.write(json.dumps(value))
+                    fp.write('\n')
+                    yield value
+            os.rename(fp.name, self._filename(key, '.jsonl'))
+        finally:
+            if os.path.exists(fp.name):
+                os.remove(fp.name)
 
     def removeAll(self):
         for filename in os.listdir(self.dirpath):
             filepath = os.path.join(self.dirpath, filename)
             os.remove(filepath)
+
+
+class MemoryCache(AbstractCache):
+    '''
+    An in-process cache, with least-recently-used eviction once it holds more
+    than `max_entries` entries or (if given) more than approximately
+    `max_bytes` bytes of JSON. It is safe to share between threads.
+
+    Entries expire `ttl` seconds after they are put (never, if ttl is None);
+    put() accepts a `ttl` argument to override that per key.
+
+    Unlike FilesystemCache, get() returns the cached object itself, not a
+    copy, so don't modify it.
+    '''
+    def __init__(self, max_entries=1000, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (value, expires, size)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            value, expires, size = entry
+            if expires is not None and expires <= time.time():
+                self._bytes -= size
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = entry
+            return value
+
+    def put(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        size = len(json.dumps(value)) if self.max_bytes is not None else 0
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._bytes -= old_entry[2]
+            self._entries[key] = (value, expires, size)
+            self._bytes += size
+            # evict least recently used entries, but always keep the new one
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                                              (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def removeAll(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class TwoLevelCache(AbstractCache):
+    '''
+    Stacks a fast cache (e.g., a MemoryCache) in front of a slower, larger
+    one (e.g., a FilesystemCache). Hits in the back cache are copied into the
+    front cache; puts and removals go to both.
+    '''
+    def __init__(self, front, back):
+        self.front = front
+        self.back = back
+
+    def get(self, key):
+        value = self.front.get(key)
+        if value is None:
+            value = self.back.get(key)
+            if value is not None:
+                self.front.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.back.put(key, value)
+        self.front.put(key, value)
+
+    def remove(self, key):
+        self.back.remove(key)
+        self.front.remove(key)
+
+    def removeAll(self):
+        self.back.removeAll()
+        self.front.removeAll()
+
+    def get_stream(self, key):
+        # streamed entries are meant to be too large for the front cache
+        return self.back.get_stream(key)
+
+    def put_stream(self, key, values):
+        self.front.remove(key)
+        return self.back.put_stream(key, values)
+
+
+class SQLiteCache(AbstractCache):
+    '''
+    Keeps all entries in a single SQLite database at `filepath`, which can be
+    shared by any number of threads and processes. Each put is a transaction,
+    so a crash can never leave a partially-written entry behind.
+
+    Entries expire `ttl` seconds after they are put (never, if ttl is None);
+    put() accepts a `ttl` argument to override that per key. If `max_entries`
+    is given, the least recently used entries are deleted to stay within it.
+
+    Streamed entries (see put_stream) are kept apart, one row per item, so
+    that they are written and read without holding the whole list in
+    memory; they count against `max_entries` separately.
+    '''
+    # number of streamed items written per transaction
+    STREAM_BATCH_SIZE = 1000
+
+    def __init__(self, filepath='/tmp/crowdflower.sqlite', ttl=None, max_entries=None, timeout=30.0):
+        self.filepath = filepath
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        # sqlite3 connections cannot be shared between threads, or forked
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                         'expires REAL, accessed REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            # streamed entries: each key's items are in stream_items, under
+            # the stream_id of its row in streams
+            conn.execute('CREATE TABLE IF NOT EXISTS streams (key TEXT PRIMARY KEY, stream_id INTEGER NOT NULL, '
+                         'expires REAL, accessed REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS stream_items (stream_id INTEGER NOT NULL, seq INTEGER NOT NULL, '
+                         'value TEXT NOT NULL, PRIMARY KEY (stream_id, seq))')
+
+    def _connection(self):
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.filepath, timeout=self.timeout)
+            # allow readers to proceed while another process is writing
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = pid
+        return self._local.conn
+
+    def _stream_connection(self, **kwargs):
+        # streams get a connection of their own, since committing on the
+        # thread's connection (e.g., a put() while a stream is being
+        # consumed) would reset their open cursor
+        return sqlite3.connect(self.filepath, timeout=self.timeout, check_same_thread=False, **kwargs)
+
+    @staticmethod
+    def _delete_streams(conn, where, args):
+        conn.execute('DELETE FROM stream_items WHERE stream_id IN (SELECT stream_id FROM streams WHERE %s)' % where,
+                     args)
+        conn.execute('DELETE FROM streams WHERE %s' % where, args)
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires <= now:
+                conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return None
+            if self.max_entries is not None:
+                conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(value)
+
+    def put(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        data = json.dumps(value)
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                         (key, data, expires, now))
+            conn.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+            if self.max_entries is not None:
+                conn.execute('DELETE FROM cache WHERE key IN '
+                             '(SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                             (self.max_entries,))
+
+    def remove(self, key):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._delete_streams(conn, 'key = ?', (key,))
+
+    def removePrefix(self, prefix):
+        '''
+        Remove all entries with keys starting with `prefix`, e.g., everything
+        for a single job with removePrefix('Job[123].'). An empty prefix
+        removes everything.
+        '''
+        if not prefix:
+            return self.removeAll()
+        # a range query can use the primary key index, unlike LIKE or GLOB
+        upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache WHERE key >= ? AND key < ?', (prefix, upper))
+            self._delete_streams(conn, 'key >= ? AND key < ?', (prefix, upper))
+
+    def removeAll(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM cache')
+            conn.execute('DELETE FROM streams')
+            # including the items of abandoned (e.g., crashed) put_streams
+            conn.execute('DELETE FROM stream_items')
+
+    def get_stream(self, key):
+        '''
+        Streamed entries are read through a cursor, one item at a time, in a
+        read transaction, so that a concurrent put_stream or remove() can't
+        change them midway. Falls back to a regular entry.
+        '''
+        now = time.time()
+        conn = self._stream_connection(isolation_level=None)
+        try:
+            conn.execute('BEGIN')
+            row = conn.execute('SELECT stream_id, expires FROM streams WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                conn.close()
+                return super(SQLiteCache, self).get_stream(key)
+        except:
+            conn.close()
+            raise
+        if self.max_entries is not None:
+            with self._connection() as update:
+                update.execute('UPDATE streams SET accessed = ? WHERE key = ?', (now, key))
+        return self._read_stream(conn, row[0])
+
+    def _read_stream(self, conn, stream_id):
+        try:
+            cursor = conn.execute('SELECT value FROM stream_items WHERE stream_id = ? ORDER BY seq', (stream_id,))
+            for (value,) in cursor:
+                yield json.loads(value)
+        finally:
+            conn.close()
+
+    def put_stream(self, key, values, ttl=None):
+        '''
+        Items are written in batches (of STREAM_BATCH_SIZE) as they are
+        yielded, under a new stream id, which replaces the key's previous one,
+        in a single transaction, only when `values` has been exhausted. If
+        iteration is abandoned or fails, the written items are deleted.
+        '''
+        if ttl is None:
+            ttl = self.ttl
+        stream_id = random.getrandbits(62)
+        conn = self._stream_connection()
+        try:
+            batch = []
+            for seq, value in enumerate(values):
+                batch.append((stream_id, seq, json.dumps(value)))
+                if len(batch) >= self.STREAM_BATCH_SIZE:
+                    with conn:
+                        conn.executemany('INSERT INTO stream_items (stream_id, seq, value) VALUES (?, ?, ?)', batch)
+                    batch = []
+                yield value
+            now = time.time()
+            with conn:
+                conn.executemany('INSERT INTO stream_items (stream_id, seq, value) VALUES (?, ?, ?)', batch)
+                self._delete_streams(conn, 'key = ? OR expires <= ?', (key, now))
+                conn.execute('INSERT INTO streams (key, stream_id, expires, accessed) VALUES (?, ?, ?, ?)',
+                             (key, stream_id, now + ttl if ttl is not None else None, now))
+                if self.max_entries is not None:
+                    self._delete_streams(conn, 'key IN (SELECT key FROM streams ORDER BY accessed DESC '
+                                               'LIMIT -1 OFFSET ?)', (self.max_entries,))
+            stream_id = None
+        finally:
+            if stream_id is not None:
+                with conn:
+                    conn.execute('DELETE FROM stream_items WHERE stream_id = ?', (stream_id,))
+            conn.close()
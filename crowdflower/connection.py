@@ -1,33 +1,83 @@
 import os
 import json
+import time
+import hashlib
+import itertools
+from urllib import urlencode
+from urlparse import urlparse
 from crowdflower.exception import CrowdFlowerError, CrowdFlowerJSONError
 from requests import Request, Session
 # I regret that python-requests can't handle merging lists of params
 from requests.utils import to_key_val_list
 
 from crowdflower import logger
+from crowdflower import pool
+from crowdflower import monitor
+from crowdflower.metrics import endpoint_template, job_id as path_job_id
 from crowdflower.job import Job
-from crowdflower.cache import FilesystemCache, NoCache, cacheable, keyfunc
-from crowdflower.serialization import rails_params
+from crowdflower.cache import AbstractCache, FilesystemCache, MemoryCache, NoCache, SQLiteCache, TwoLevelCache, cacheable, keyfunc
+from crowdflower.serialization import rails_params, rails_form, ndjson
+from crowdflower.policy import RequestPolicy, response_validators
 
 
 class Connection(object):
     DEFAULT_API_KEY = os.getenv('CROWDFLOWER_API_KEY')
     DEFAULT_API_URL = 'https://api.crowdflower.com/v1'
     _cache_key_attrs = ('api_key',)
+    # number of /jobs pages to request ahead of the one being consumed
+    JOBS_PREFETCH = 2
 
-    def __init__(self, cache=None, api_key=DEFAULT_API_KEY, api_url=DEFAULT_API_URL):
+    def __init__(self, cache=None, api_key=DEFAULT_API_KEY, api_url=DEFAULT_API_URL, policy=None, revalidate=False,
+                 metrics=None, params_encoding='query'):
+        '''
+        `cache` can be 'filesystem', 'sqlite', 'memory', 'memory+filesystem' (a
+        MemoryCache in front of a FilesystemCache), any AbstractCache instance,
+        or None, for no caching.
+
+        `policy` controls how requests are sent, e.g., with rate limiting and
+        retries (see crowdflower.policy.RetryPolicy). By default, each request
+        is sent once.
+
+        If `revalidate` is True, cached properties, tags, units, and job_ids
+        are not served from the cache without checking for changes. Instead,
+        every GET request is sent with the ETag / Last-Modified validators of
+        the last response to it (which are stored in the cache, along with the
+        body), and a '304 Not Modified' response is answered from the cache.
+
+        `metrics` is a callable that is called with a dict describing every
+        request sent (type='request', method, endpoint template, job_id,
+        status, error, latency, request_bytes, response_bytes, retries) and
+        every cacheable call (type='cache', family, result, latency). Use a
+        crowdflower.metrics.Registry to collect them and get a summary.
+
+        `params_encoding` determines how nested job settings, tags, and orders
+        (see rails_request) are sent: 'query' (in the URL), 'form' (as an
+        application/x-www-form-urlencoded body), or 'json' (as a JSON body).
+        Use 'form' or 'json' to avoid huge URLs when setting a long cml, css,
+        js, or instructions.
+        '''
         if api_key is None:
             logger.warning("No API key given.")
         self.api_key = api_key
         self.api_url = api_url
 
-        if cache == 'filesystem':
+        if isinstance(cache, AbstractCache):
+            self._cache = cache
+        elif cache == 'filesystem':
             self._cache = FilesystemCache()
-        # elif ... others?
+        elif cache == 'memory':
+            self._cache = MemoryCache()
+        elif cache == 'sqlite':
+            self._cache = SQLiteCache()
+        elif cache == 'memory+filesystem':
+            self._cache = TwoLevelCache(MemoryCache(), FilesystemCache())
         else:
             self._cache = NoCache()
 
+        self.policy = policy or RequestPolicy()
+        self.revalidate = revalidate
+        self.metrics = metrics
+        self.params_encoding = params_encoding
         self._session = Session()
 
     def __repr__(self):
@@ -37,10 +87,17 @@ class Connection(object):
         url = self.api_url + path
         return Request(method=method, url=url, **kw)
 
-    def send_request(self, req):
+    def send_request(self, req, stream=False, validators=None):
         '''
         returns requests.Response object
 
+        If `stream` is True, the response body is not read until the caller
+        consumes it, e.g., with res.iter_content(...)
+
+        If `validators` (a dict like policy.response_validators returns) is
+        given, the request is made conditional on them, and a '304 Not
+        Modified' response is returned rather than raised.
+
         raise
         '''
         # requests gotcha: even if send through the session, request.prepare()
@@ -49,24 +106,85 @@ class Connection(object):
 
         # merge params with the api key
         req.params = to_key_val_list(req.params) + [('key', self.api_key)]
+        if validators:
+            if 'etag' in validators:
+                req.headers['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                req.headers['If-Modified-Since'] = validators['last_modified']
         prepared_req = self._session.prepare_request(req)
         logger.debug('Request params: {}'.format(req.params))
 
-        res = self._session.send(prepared_req)
-        if res.status_code != 200:
+        started = time.time()
+        try:
+            res = self.policy.send(self._session, prepared_req, stream=stream)
+        except Exception, exc:
+            self._emit_request_event(prepared_req, None, started, stream, exc)
+            raise
+        self._emit_request_event(prepared_req, res, started, stream)
+        if res.status_code != 200 and not (validators and res.status_code == 304):
             # CrowdFlower responds with a '202 Accepted' when we request a bulk
             # download which has not yet been generated, which means we simply
             # have to wait and try again
             raise CrowdFlowerError(req, res)
         return res
 
+    def _emit_request_event(self, prepared_req, res, started, stream, exc=None):
+        if self.metrics is None:
+            return
+        path = prepared_req.path_url.split('?')[0]
+        api_path = urlparse(self.api_url).path
+        if path.startswith(api_path):
+            path = path[len(api_path):]
+        request_bytes = len(prepared_req.body) if isinstance(prepared_req.body, basestring) else None
+        response_bytes = None
+        error = repr(exc) if exc is not None else None
+        if res is not None:
+            if res.status_code >= 400:
+                error = '%d %s' % (res.status_code, res.reason)
+            if not stream:
+                response_bytes = len(res.content)
+            elif 'Content-Length' in res.headers:
+                response_bytes = int(res.headers['Content-Length'])
+        self.metrics(dict(
+            type='request',
+            method=prepared_req.method,
+            endpoint=endpoint_template(path),
+            job_id=path_job_id(path),
+            status=res.status_code if res is not None else None,
+            error=error,
+            latency=time.time() - started,
+            request_bytes=request_bytes,
+            response_bytes=response_bytes,
+            retries=getattr(res if res is not None else exc, 'retries', 0),
+        ))
+
     def request(self, path, method='GET', params=None, headers=None, data=None):
         # simple request helper
         if headers is None:
             headers = dict()
         headers.update(Accept='application/json')
+        # params may be a generator, e.g., from rails_params
+        params = to_key_val_list(params)
         req = self.create_request(path, method=method, params=params, headers=headers, data=data)
+        if self.revalidate and method == 'GET':
+            return self._conditional_request(req)
         res = self.send_request(req)
+        return self._json(req, res)
+
+    def rails_request(self, path, method, params):
+        '''
+        Send the nested dict `params` as Rails-style parameters (like
+        'job[options][foo]=bar'), encoded according to self.params_encoding.
+        '''
+        if self.params_encoding == 'form':
+            return self.request(path, method=method, data=rails_form(params),
+                                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        if self.params_encoding == 'json':
+            return self.request(path, method=method, data=json.dumps(params),
+                                headers={'Content-Type': 'application/json'})
+        return self.request(path, method=method, params=rails_params(params))
+
+    def _json(self, req, res):
         try:
             # what Requests might actually raise is a simplejson.scanner.JSONDecodeError,
             # but I'm pretty sure that's the only error .json() might raise, so we don't
@@ -75,12 +193,31 @@ class Connection(object):
         except Exception, err:
             raise CrowdFlowerJSONError(req, res, err)
 
+    def _conditional_request(self, req):
+        '''
+        Send the GET request `req`, conditional on the validators stored in the
+        cache from the last response to the same URL, and return its JSON body
+        (from the cache, if the response is a '304 Not Modified').
+        '''
+        url = '%s?%s' % (req.url, urlencode(sorted(req.params or [])))
+        key = keyfunc(self, 'http:%s' % hashlib.md5(url).hexdigest())
+        entry = self._cache.get(key)
+        res = self.send_request(req, validators=entry)
+        if res.status_code == 304:
+            logger.info('not modified; reading %s from cache', url)
+            return entry['body']
+        body = self._json(req, res)
+        validators = response_validators(res)
+        if validators:
+            self._cache.put(key, dict(body=body, **validators))
+        return body
+
     def job(self, job_id):
         # doesn't actually call anything
         return Job(job_id, self)
 
     @property
-    @cacheable()
+    @cacheable(revalidate=True)
     def job_ids(self):
         '''
         The API documentation does not specify this, but there is a hard-coded
@@ -88,23 +225,35 @@ class Connection(object):
         page through until we get a response with fewer than 10 items.
 
         Apparently, other parameters, like query='pt' and fields[]='tags' don't work.
+
+        The next pages are requested in the background (up to JOBS_PREFETCH
+        pages ahead) while the current page is being consumed. Each job's
+        properties are included in the listing, so they are written to the
+        cache as Job[id].properties, saving a request per job later.
         '''
-        page = 0
-        while True:
-            page += 1
-            params = dict(page=page)
-            jobs_response = self.request('/jobs', params=params)
-            for job_properties in jobs_response:
-                # somehow add the Job's properties to the cache, since we have all the data anyway?
-                # if a job is in an invalid state, the response will not have
-                # an 'id' key for that job, but an 'errors' key pointing to a
-                # list of strings decribing the error(s)
-                if 'id' in job_properties:
-                    yield job_properties['id']
-                else:
-                    continue
-            if len(jobs_response) < 10:
-                break
+        pages = pool.imap(self._jobs_page, itertools.count(1),
+                          threads=self.JOBS_PREFETCH, window=self.JOBS_PREFETCH)
+        try:
+            for jobs_response in pages:
+                for job_properties in jobs_response:
+                    # if a job is in an invalid state, the response will not have
+                    # an 'id' key for that job, but an 'errors' key pointing to a
+                    # list of strings decribing the error(s)
+                    if 'id' in job_properties:
+                        job = Job(job_properties['id'], self)
+                        self._cache.put(keyfunc(job, 'properties'), job_properties)
+                        yield job_properties['id']
+                    else:
+                        continue
+                if len(jobs_response) < 10:
+                    break
+        finally:
+            # stop prefetching
+            pages.close()
+
+    def _jobs_page(self, page):
+        params = dict(page=page)
+        return self.request('/jobs', params=params)
 
     def jobs(self):
         '''
@@ -114,26 +263,59 @@ class Connection(object):
         for job_id in self.job_ids:
             yield Job(job_id, self)
 
+    def ping_many(self, job_ids, threads=8):
+        '''
+        Fetch the ping counts and properties of many jobs concurrently, in up
+        to `threads` threads, and yield their statuses (see
+        crowdflower.monitor.job_status) as they arrive, in no particular
+        order. Errors are captured in each status's 'error', not raised:
+
+            for status in conn.ping_many(conn.job_ids):
+                if status['error'] is None:
+                    print status['id'], status['ping']['needed_judgments']
+        '''
+        return pool.imap_unordered(lambda job_id: monitor.job_status(self, job_id), job_ids, threads=threads)
+
+    def watch_jobs(self, job_ids, threads=8, min_interval=30.0, max_interval=900.0, max_errors=5):
+        '''
+        Like ping_many, but keeps polling each job until it is finished or
+        canceled, more often for jobs whose needed_judgments is falling
+        fast, and less often for jobs that aren't progressing (see
+        crowdflower.monitor.watch). This runs until every job is done, or
+        has failed with a 4xx error or `max_errors` consecutive errors.
+        '''
+        return monitor.watch(self, job_ids, threads=threads, min_interval=min_interval, max_interval=max_interval,
+                             max_errors=max_errors)
+
     def create_job(self, props):
         '''
         Creates an empty job with given `props` attributes.
         '''
-        params = rails_params({'job': props})
-        job_response = self.request('/jobs', method='POST', params=params)
+        job_response = self.rails_request('/jobs', 'POST', {'job': props})
         job = Job(job_response['id'], self)
         job._properties = job_response
         # bust cache of job_ids
         self._cache.remove(keyfunc(self, 'job_ids'))
         return job
 
-    def upload(self, units):
+    def upload(self, units, stream=False):
         '''
+        Creates a new job from an iterable of units (dicts).
+
+        If `stream` is True, the body is serialized lazily and sent with
+        chunked transfer encoding, instead of being built in memory first.
+        To upload more units in concurrent batches, use Job.upload_batches
+        on the returned job.
+
         TODO: allow setting Job parameters at the same time
         '''
         headers = {'Content-Type': 'application/json'}
         # N.b.: CF expects newline-separated JSON, not actual JSON
         # e.g., this would fail with a status 500: kwargs['data'] = json.dumps(data)
-        data = '\n'.join(json.dumps(unit) for unit in units)
+        if stream:
+            data = ndjson(units)
+        else:
+            data = '\n'.join(json.dumps(unit) for unit in units)
 
         job_response = self.request('/jobs/upload', method='POST', headers=headers, data=data)
         job = Job(job_response['id'], self)
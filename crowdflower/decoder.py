@@ -0,0 +1,229 @@
+import re
+import csv
+import keyword
+from datetime import datetime
+from collections import namedtuple
+
+
+# types of the fixed columns in full reports (see Job.download())
+INTEGER_COLUMNS = ('_unit_id', '_id', '_worker_id')
+FLOAT_COLUMNS = ('_trust',)
+BOOLEAN_COLUMNS = ('_golden', '_tainted')
+TIMESTAMP_COLUMNS = ('_created_at', '_started_at')
+# and those with few distinct values
+CATEGORY_COLUMNS = ('_canary', '_missed', '_channel', '_country', '_region', '_city')
+
+
+def to_integer(value):
+    return int(value) if value else None
+
+
+def to_float(value):
+    return float(value) if value else None
+
+
+def to_boolean(value):
+    if value == 'true':
+        return True
+    if value == 'false':
+        return False
+    return None
+
+
+def to_datetime(value):
+    '''
+    Parse a CrowdFlower 'm/d/yyyy hh:mm:ss' timestamp into a (naive, UTC)
+    datetime, or None if it's empty.
+    '''
+    if not value:
+        return None
+    date, time = value.split(' ')
+    month, day, year = date.split('/')
+    hour, minute, second = time.split(':')
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+
+
+def datetimes():
+    '''
+    Returns a converter like to_datetime, which parses each distinct date
+    only once (reports have many timestamps, but few dates).
+    '''
+    dates = dict()
+
+    def to_datetime(value):
+        if not value:
+            return None
+        date, time = value.split(' ')
+        ymd = dates.get(date)
+        if ymd is None:
+            month, day, year = date.split('/')
+            ymd = dates[date] = (int(year), int(month), int(day))
+        hour, minute, second = time.split(':')
+        return datetime(ymd[0], ymd[1], ymd[2], int(hour), int(minute), int(second))
+    return to_datetime
+
+
+def to_text(value):
+    return value.decode('utf8')
+
+
+def categorical():
+    '''
+    Returns a converter that decodes each distinct value only once, and
+    returns the same unicode object for every occurrence of it.
+    '''
+    decoded = dict()
+
+    def to_category(value):
+        text = decoded.get(value)
+        if text is None:
+            text = decoded[value] = value.decode('utf8')
+        return text
+    return to_category
+
+
+# converter factories for each column type
+CONVERTERS = {
+    'integer': lambda: to_integer,
+    'float': lambda: to_float,
+    'boolean': lambda: to_boolean,
+    'datetime': datetimes,
+    'text': lambda: to_text,
+    'category': categorical,
+    # left as a UTF-8 encoded str
+    'raw': lambda: str,
+}
+
+
+def infer_types(header, legend=None, types=None):
+    '''
+    Returns a dict of the type (a key of CONVERTERS) of each column in the
+    report `header`: the fixed '_'-prefixed columns have known types; the
+    job's CML fields (the keys of `legend`, see Job.legend()) and their
+    '_gold' columns are categories; and the rest (the units' data) is text.
+    `types` overrides any of those.
+    '''
+    legend = legend or dict()
+    inferred = dict()
+    for name in header:
+        if name in INTEGER_COLUMNS:
+            inferred[name] = 'integer'
+        elif name in FLOAT_COLUMNS or name.endswith(':confidence'):
+            inferred[name] = 'float'
+        elif name in BOOLEAN_COLUMNS:
+            inferred[name] = 'boolean'
+        elif name in TIMESTAMP_COLUMNS:
+            inferred[name] = 'datetime'
+        elif name in CATEGORY_COLUMNS or name in legend or (name.endswith('_gold') and name[:-5] in legend):
+            inferred[name] = 'category'
+        else:
+            inferred[name] = 'text'
+    inferred.update(types or dict())
+    return inferred
+
+
+def field_name(name):
+    '''
+    Turn a column name into a valid namedtuple field name, e.g., '_unit_id'
+    becomes 'unit_id' and 'sentiment:confidence' becomes 'sentiment_confidence'.
+    '''
+    name = re.sub(r'\W', '_', name).lstrip('_')
+    if not name or name[0].isdigit() or keyword.iskeyword(name):
+        name = 'field_' + name
+    return name
+
+
+class ReportDecoder(object):
+    '''
+    Converts rows of a report (lists of UTF-8 encoded strings, e.g., from a
+    csv.reader) into tuples of typed values, like:
+
+        (495781935, datetime(2015, 5, 25, 10, 29), False, u'', 1624364000, ...)
+
+    with a converter for each column, chosen once, by type (see infer_types).
+    If `namedtuples` is True, rows are namedtuples, with the column names
+    made into valid, unique field names (see field_name; e.g., row.unit_id),
+    and the original names in `Row.columns`.
+    '''
+    def __init__(self, header, types=None, legend=None, namedtuples=False):
+        self.header = list(header)
+        self.types = infer_types(self.header, legend=legend, types=types)
+        self.converters = [CONVERTERS[self.types[name]]() for name in self.header]
+        self.Row = None
+        if namedtuples:
+            fields = []
+            for name in self.header:
+                field = field_name(name)
+                # e.g., a unit's 'id' after the report's '_id'
+                while field in fields:
+                    field += '_'
+                fields.append(field)
+            self.Row = namedtuple('Row', fields)
+            self.Row.columns = tuple(self.header)
+        self.decode = self._compile()
+
+    def __repr__(self):
+        return '<{:} of {:} columns>'.format(self.__class__.__name__, len(self.header))
+
+    def _compile(self):
+        # build a function like
+        #   lambda row: (c0(row[0]), c1(row[1]), ...)
+        # which is much faster than looping over the converters for every row
+        scope = dict(('c%d' % index, converter) for index, converter in enumerate(self.converters))
+        values = ', '.join('c%d(row[%d])' % (index, index) for index in range(len(self.converters)))
+        if self.Row is not None:
+            scope['Row'] = self.Row
+            source = 'lambda row: Row(%s)' % values
+        else:
+            source = 'lambda row: (%s%s)' % (values, ',' if len(self.converters) == 1 else '')
+        return eval(source, scope)
+
+    def decode_rows(self, rows):
+        decode = self.decode
+        width = len(self.header)
+        for row in rows:
+            if len(row) < width:
+                # like csv.DictReader, treat missing trailing values as empty
+                row = row + [''] * (width - len(row))
+            yield decode(row)
+
+
+def batched(rows, batch_size):
+    '''
+    Group an iterable of rows into lists of up to `batch_size` rows.
+    '''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def decode_report(files, types=None, legend=None, namedtuples=False, batch_size=None):
+    '''
+    Decode the rows of an iterable of report CSV files (file-like objects of
+    UTF-8 encoded bytes), each with a header, with ReportDecoders (one per
+    distinct header). If `batch_size` is given, yield lists of up to that
+    many rows, instead of single rows.
+    '''
+    if batch_size is not None:
+        return batched(decode_report(files, types=types, legend=legend, namedtuples=namedtuples), batch_size)
+    return _decode_files(files, types, legend, namedtuples)
+
+
+def _decode_files(files, types, legend, namedtuples):
+    decoders = dict()
+    for fp in files:
+        reader = csv.reader(fp)
+        header = next(reader, None)
+        if header is None:
+            continue
+        decoder = decoders.get(tuple(header))
+        if decoder is None:
+            decoder = decoders[tuple(header)] = ReportDecoder(header, types=types, legend=legend,
+                                                              namedtuples=namedtuples)
+        for row in decoder.decode_rows(reader):
+            yield row
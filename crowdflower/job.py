@@ -1,14 +1,24 @@
+import os
 import csv
 import json
+import time
 import shutil
+import hashlib
 import zipfile
 from pprint import pformat
-from cStringIO import StringIO
+from tempfile import SpooledTemporaryFile, mkstemp
 
 from crowdflower import logger
+from crowdflower import pool
+from crowdflower import backoff
 from crowdflower.exception import CrowdFlowerError
 from crowdflower.cache import cacheable, keyfunc
-from crowdflower.serialization import rails_params
+from crowdflower.serialization import ndjson, ndjson_batches
+from crowdflower.policy import response_validators
+from crowdflower.writer import UnitWriter
+from crowdflower.unit import Unit, Judgment
+from crowdflower.decoder import ReportDecoder, decode_report, batched
+from crowdflower.parallel import report_batches
 
 
 class Job(object):
@@ -58,11 +68,26 @@ class Job(object):
     '''
     READ_WRITE_FIELDS = ['auto_order', 'auto_order_threshold', 'auto_order_timeout', 'cml', 'cml_fields', 'confidence_fields', 'css', 'custom_key', 'excluded_countries', 'gold_per_assignment', 'included_countries', 'instructions', 'js', 'judgments_per_unit', 'language', 'max_judgments_per_unit', 'max_judgments_per_contributor', 'min_unit_confidence', 'options', 'pages_per_assignment', 'problem', 'send_judgments_webhook', 'state', 'title', 'units_per_assignment', 'webhook_uri']
     _cache_key_attrs = ('id',)
+    # reports are streamed to a temporary file in chunks of this many bytes,
+    # which is kept in memory only until it grows larger than SPOOL_MAX_SIZE
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    SPOOL_MAX_SIZE = 16 * 1024 * 1024
+    # keyword arguments to crowdflower.backoff.delays when waiting for reports
+    REPORT_BACKOFF = dict(initial=1.0, maximum=60.0, factor=2.0, jitter=0.5)
+    # the maximum (and default) `limit` for /jobs/{job_id}/units
+    UNITS_PAGE_SIZE = 1000
+    # default maximum size of the body of each request sent by upload_batches
+    UPLOAD_BATCH_BYTES = 4 * 1024 * 1024
 
     def __init__(self, job_id, connection):
         self.id = job_id
         self._connection = connection
         self._cache = self._connection._cache
+        # seconds spent waiting for the last report to be generated
+        self.last_report_wait = None
+        # shared by all of this job's Unit / Judgment records; see unit_schema
+        self._unit_schema = None
+        self._judgment_schema = None
 
     def __repr__(self):
         return pformat(self.properties)
@@ -71,31 +96,53 @@ class Job(object):
         self._cache.remove(keyfunc(self, func_attr))
 
     @property
-    @cacheable()
+    def unit_schema(self):
+        # created on first use, since most jobs never make records (two
+        # threads racing here only end up with records in separate schemas)
+        if self._unit_schema is None:
+            self._unit_schema = Unit.new_schema()
+        return self._unit_schema
+
+    @property
+    def judgment_schema(self):
+        if self._judgment_schema is None:
+            self._judgment_schema = Judgment.new_schema()
+        return self._judgment_schema
+
+    @property
+    def revalidate(self):
+        # see Connection(revalidate=...)
+        return self._connection.revalidate
+
+    @property
+    def metrics(self):
+        # see Connection(metrics=...)
+        return self._connection.metrics
+
+    @property
+    @cacheable(revalidate=True)
     def properties(self):
         return self._connection.request('/jobs/%s' % self.id)
 
 
-    @cacheable('tags')
+    @cacheable('tags', revalidate=True)
     def get_tags(self):
         res = self._connection.request('/jobs/%s/tags' % self.id)
         return [item['name'] for item in res]
 
     def set_tags(self, tags):
-        params = rails_params({'tags': tags})
-        self._connection.request('/jobs/%s/tags' % self.id, method='PUT', params=params)
+        self._connection.rails_request('/jobs/%s/tags' % self.id, 'PUT', {'tags': tags})
         self._cache_flush('tags')
 
     tags = property(get_tags, set_tags)
 
     def add_tags(self, tags):
-        params = rails_params({'tags': tags})
-        self._connection.request('/jobs/%s/tags' % self.id, method='POST', params=params)
+        self._connection.rails_request('/jobs/%s/tags' % self.id, 'POST', {'tags': tags})
         self._cache_flush('tags')
 
 
     @property
-    @cacheable()
+    @cacheable(revalidate=True)
     def units(self):
         '''
         Returns a list of units, e.g.,
@@ -134,17 +181,67 @@ class Job(object):
 
         The returned units are not fully hydrated; in fact, the response only includes each unit id and the original unit payload. To see the crowd's responses, you must use /jobs/{job.id}/units/{unit.id}, or the bulk download method (see Job.download()).
 
+        Use iter_units() to stream the units without holding them all in
+        memory, or to fetch the pages concurrently.
         '''
+        return self._iter_units()
+
+    def _units_page(self, page):
+        params = dict(page=page)
+        units_response = self._connection.request('/jobs/%s/units' % self.id, params=params)
+        units = []
+        for unit_id, unit_properties in units_response.items():
+            # hopefully the user has not specified '_unit_id' as a custom field
+            unit_properties['_unit_id'] = unit_id
+            units.append(unit_properties)
+        return units
+
+    def iter_units(self, threads=1, records=False):
+        '''
+        Iterate over all of this job's units (see Job.units). On a cache miss,
+        units are streamed into the cache as they are yielded; on a hit, they
+        are read back lazily.
+
+        With threads=1, pages are requested one at a time until a short page
+        comes back. Otherwise, the number of pages is estimated from
+        properties['units_count'] (or ping()['all_units']), and those pages are
+        requested concurrently with a pool of `threads` threads. Units are
+        still yielded page by page, in order. If the estimate turns out to be
+        too low, the remaining pages are requested serially.
+
+        If `records` is True, crowdflower.unit.Unit records are yielded
+        instead of dicts, which take much less memory (and are still read
+        like dicts).
+        '''
+        units = self._stream_units(threads=threads)
+        if records:
+            return (Unit.from_dict(unit, self.unit_schema) for unit in units)
+        return units
+
+    @cacheable('units', stream=True, revalidate=True)
+    def _stream_units(self, threads=1):
+        return self._iter_units(threads=threads)
+
+    def _iter_units(self, threads=1):
         page = 0
+        if threads > 1:
+            units_count = self.properties.get('units_count')
+            if units_count is None:
+                units_count = self.ping()['all_units']
+            # ceiling division; always request at least one page
+            pages_count = max(1, -(-units_count // self.UNITS_PAGE_SIZE))
+            for units in pool.imap(self._units_page, range(1, pages_count + 1), threads=threads):
+                for unit in units:
+                    yield unit
+            page = pages_count
+            if len(units) < self.UNITS_PAGE_SIZE:
+                return
         while True:
             page += 1
-            params = dict(page=page)
-            units_response = self._connection.request('/jobs/%s/units' % self.id, params=params)
-            for unit_id, unit_properties in units_response.items():
-                # hopefully the user has not specified '_unit_id' as a custom field
-                unit_properties['_unit_id'] = unit_id
-                yield unit_properties
-            if len(units_response) < 1000:
+            units = self._units_page(page)
+            for unit in units:
+                yield unit
+            if len(units) < self.UNITS_PAGE_SIZE:
                 break
 
     def delete_unit(self, unit_id):
@@ -166,23 +263,88 @@ class Job(object):
 
         return res
 
-    def upload(self, units):
+    def unit_writer(self, **kwargs):
+        '''
+        Returns a UnitWriter for this job, which buffers units added with its
+        upload_unit() method and uploads them in batches. See UnitWriter for
+        the keyword arguments.
+        '''
+        return UnitWriter(self, **kwargs)
+
+    def _upload(self, data):
         headers = {'Content-Type': 'application/json'}
-        data = '\n'.join(json.dumps(unit) for unit in units)
-        logger.debug('Uploading data to Job[%d]: %s', self.id, data)
-        res = self._connection.request('/jobs/%s/upload' % self.id, method='POST', headers=headers, data=data)
+        return self._connection.request('/jobs/%s/upload' % self.id, method='POST', headers=headers, data=data)
+
+    def upload(self, units, stream=False):
+        '''
+        Upload an iterable of units (dicts) to the job in a single request.
+
+        If `stream` is True, the body is serialized lazily and sent with
+        chunked transfer encoding, instead of being built in memory first.
+        '''
+        logger.debug('Uploading data to Job[%d]', self.id)
+        if stream:
+            data = ndjson(units)
+        else:
+            data = '\n'.join(json.dumps(unit) for unit in units)
+        res = self._upload(data)
 
         # reset cached units
         self._cache_flush('units')
 
         return res
 
+    def upload_batches(self, units, batch_bytes=UPLOAD_BATCH_BYTES, threads=1):
+        '''
+        Upload an iterable of units (dicts) to the job in batches of at most
+        `batch_bytes` bytes each, sending up to `threads` batches at once. Only
+        a few batches are held in memory at any time.
+
+        Returns a dict like:
+
+            {
+                'batches': 3,
+                'units_count': 2500,
+                'responses': [...],
+                'errors': [(1, CrowdFlowerError(...))],
+            }
+
+        where 'responses' contains the API response for each batch, in order
+        (None for a batch that failed), 'units_count' counts the units in the
+        batches that were uploaded, and 'errors' lists the (index, exception)
+        of each batch that failed. A failed batch does not stop the others, so
+        only the failed batches need to be sent again.
+        '''
+        def upload_batch(indexed_batch):
+            index, batch = indexed_batch
+            logger.debug('Uploading batch of %d units to Job[%d]', len(batch), self.id)
+            try:
+                return index, len(batch), self._upload('\n'.join(batch)), None
+            except Exception, exc:
+                logger.error('Failed to upload batch %d of %d units to Job[%s]: %r', index, len(batch), self.id, exc)
+                return index, len(batch), None, exc
+
+        result = dict(batches=0, units_count=0, responses=[], errors=[])
+        try:
+            batches = enumerate(ndjson_batches(units, batch_bytes))
+            for index, batch_units_count, res, exc in pool.imap(upload_batch, batches, threads=threads):
+                result['batches'] += 1
+                result['responses'].append(res)
+                if exc is None:
+                    result['units_count'] += batch_units_count
+                else:
+                    result['errors'].append((index, exc))
+        finally:
+            # reset cached units, once, even if some batch failed
+            self._cache_flush('units')
+
+        return result
+
     def update(self, props):
-        params = rails_params({'job': props})
-        logger.debug('Updating Job[%d]: %r', self.id, params)
+        logger.debug('Updating Job[%d]: %r', self.id, props)
 
         try:
-            res = self._connection.request('/jobs/%s' % self.id, method='PUT', params=params)
+            res = self._connection.rails_request('/jobs/%s' % self.id, 'PUT', {'job': props})
         except CrowdFlowerError, exc:
             # CrowdFlower sometimes likes to redirect the PUT to a non-API page,
             # which will raise an error (406 Not Accepted), but we can just
@@ -263,8 +425,8 @@ class Job(object):
             (sandbox mode) and / or 'on_demand' (normal)
         '''
         channels = list(channels)
-        data = rails_params(dict(channels=channels, debit=dict(units_count=units_count)))
-        res = self._connection.request('/jobs/%s/orders' % self.id, method='POST', params=data)
+        params = dict(channels=channels, debit=dict(units_count=units_count))
+        res = self._connection.rails_request('/jobs/%s/orders' % self.id, 'POST', params)
         self._cache_flush('properties')
         return res
 
@@ -317,7 +479,105 @@ class Job(object):
         response = self._connection.request('/jobs/%s/copy' % self.id, method='GET', params=params)
         return Job(response['id'], self._connection)
 
-    def download(self, full=True):
+    def _report_response(self, params, wait=None, validators=None):
+        '''
+        Request the zipped report at /jobs/{job_id}.csv, returning the streamed
+        response without reading its body.
+
+        CrowdFlower responds with a '202 Accepted' while the report is being
+        generated. If `wait` is None, that raises a CrowdFlowerError right
+        away; otherwise, the request is retried with exponential backoff (see
+        REPORT_BACKOFF) until the report is ready or `wait` seconds have passed.
+        The number of seconds spent waiting is saved as job.last_report_wait.
+
+        If `validators` are given, the request is conditional on them (see
+        Connection.send_request), and the response may be a '304 Not Modified'.
+        '''
+        started = time.time()
+        for delay in backoff.delays(**self.REPORT_BACKOFF):
+            # use .csv, not headers=dict(Accept='text/csv'), which Crowdflower rejects
+            req = self._connection.create_request('/jobs/%s.csv' % self.id, method='GET', params=params)
+            try:
+                res = self._connection.send_request(req, stream=True, validators=validators)
+                break
+            except CrowdFlowerError, exc:
+                remaining = started + (wait or 0) - time.time()
+                if wait is None or exc.response.status_code != 202 or remaining <= 0:
+                    raise
+                exc.response.close()
+                logger.info('Report for Job[%s] is not ready; trying again in %.1f seconds', self.id, delay)
+                time.sleep(min(delay, remaining))
+        self.last_report_wait = time.time() - started
+        logger.info('Report for Job[%s] was ready after %.1f seconds', self.id, self.last_report_wait)
+        return res
+
+    def _download_zip(self, params, filepath=None, wait=None, revalidate=True):
+        '''
+        Stream the zipped report from /jobs/{job_id}.csv to `filepath` (or a
+        SpooledTemporaryFile, if no filepath is given) and return a
+        zipfile.ZipFile reading from it. Because ZipFile insists on seeking, we
+        can't simply pass over the res.raw stream.
+
+        Closing the returned ZipFile does not close the underlying file, which
+        is available as zf.fp.
+
+        If the connection revalidates (see Connection) and `filepath` already
+        holds a report downloaded with the same `params`, the download is
+        conditional on that report's validators, and if the report has not
+        been modified, the existing file is used (unless `revalidate` is
+        False, e.g., for a temporary file). The report is downloaded to a
+        temporary file next to `filepath`, which replaces it only once it is
+        complete.
+        '''
+        key = None
+        validators = None
+        if filepath is not None and self.revalidate and revalidate:
+            key = keyfunc(self, 'report:%s' % hashlib.md5(repr((sorted(params.items()), filepath))).hexdigest())
+            if os.path.exists(filepath):
+                validators = self._cache.get(key)
+        res = self._report_response(params, wait=wait, validators=validators)
+        if res.status_code == 304:
+            res.close()
+            try:
+                zf = zipfile.ZipFile(open(filepath, 'rb'))
+            except zipfile.BadZipfile:
+                # e.g., truncated by an older version; download it again
+                logger.info('Report for Job[%s] not modified, but %s is not a valid zip file', self.id, filepath)
+                self._cache.remove(key)
+                return self._download_zip(params, filepath=filepath, wait=wait)
+            logger.info('Report for Job[%s] not modified; reading %s', self.id, filepath)
+            return zf
+        temppath = None
+        if filepath is None:
+            fp = SpooledTemporaryFile(max_size=self.SPOOL_MAX_SIZE)
+        else:
+            # written next to `filepath`, and only renamed over it once it's
+            # complete, so that an interrupted download never leaves a
+            # truncated report (with the old report's validators) behind
+            fd, temppath = mkstemp(prefix='.%s-' % os.path.basename(filepath), suffix='.part',
+                                   dir=os.path.dirname(os.path.abspath(filepath)))
+            fp = os.fdopen(fd, 'w+b')
+        try:
+            for chunk in res.iter_content(chunk_size=self.DOWNLOAD_CHUNK_SIZE):
+                fp.write(chunk)
+            # ZipFile does fp.seek(...) itself
+            zf = zipfile.ZipFile(fp)
+            if temppath is not None:
+                os.rename(temppath, filepath)
+                temppath = None
+            if key is not None:
+                self._cache.put(key, response_validators(res))
+            return zf
+        except:
+            fp.close()
+            raise
+        finally:
+            res.close()
+            if temppath is not None:
+                os.remove(temppath)
+
+    def download(self, full=True, filepath=None, wait=None, regenerate=False, records=False,
+                 processes=None, ordered=True):
         '''The resulting CSV will have headers like:
 
             _unit_id
@@ -364,29 +624,212 @@ class Job(object):
             text
             sentiment
             sentiment_gold
+
+        If `filepath` is given, the zipped report is saved there; otherwise it
+        is spooled to a temporary file, so that memory usage does not depend on
+        the size of the report. Rows are read lazily from the zip's members.
+
+        If `wait` is given, wait up to that many seconds for the report to be
+        generated, instead of raising a CrowdFlowerError if it is not ready.
+        If `regenerate` is True, trigger regeneration of the report first.
+
+        If `records` is True, crowdflower.unit.Judgment records are yielded
+        instead of dicts, which take much less memory (and are still read
+        like dicts).
+
+        If `processes` is given, the report's CSV files are decompressed and
+        parsed in a pool of that many processes (see
+        crowdflower.parallel.report_batches), with large files split into
+        chunks. If `ordered` is False, rows are yielded in the order that the
+        chunks finish, not the order of the report.
         '''
-        # pulls down the csv endpoint, unzips it, and returns a list of all the rows
-        params = dict(full='true' if full else 'false')
-        # use .csv, not headers=dict(Accept='text/csv'), which Crowdflower rejects
-        req = self._connection.create_request('/jobs/%s.csv' % self.id, method='GET', params=params)
-        res = self._connection.send_request(req)
-        # because ZipFile insists on seeking, we can't simply pass over the res.raw stream
-        fp = StringIO()
-        fp.write(res.content)
-        # ZipFile does fp.seek(0) itself
-        zf = zipfile.ZipFile(fp)
-        for zipinfo in zf.filelist:
-            zipinfo_fp = zf.open(zipinfo)
-            reader = csv.DictReader(zipinfo_fp)
+        if processes is not None:
+            batches = self._parallel_report_batches('lists' if records else 'dicts', None, processes, ordered,
+                                                    full=full, filepath=filepath, wait=wait, regenerate=regenerate)
+            for header, rows in batches:
+                if records:
+                    rows = Judgment.from_rows(header, rows, self.judgment_schema)
+                for row in rows:
+                    yield row
+            return
+        # pulls down the csv endpoint, unzips it, and yields all the rows
+        for member_fp in self._report_members(full=full, filepath=filepath, wait=wait, regenerate=regenerate):
+            if records:
+                reader = csv.reader(member_fp)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                rows = ([value.decode('utf8') for value in row] for row in reader)
+                for judgment in Judgment.from_rows(header, rows, self.judgment_schema):
+                    yield judgment
+                continue
+            reader = csv.DictReader(member_fp)
             for row in reader:
                 yield {key: value.decode('utf8') for key, value in row.items()}
 
+    def decode_report(self, types=None, legend=True, namedtuples=False, batch_size=None,
+                      full=True, filepath=None, wait=None, regenerate=False, processes=None, ordered=True):
+        '''
+        Iterate over the rows of the report as tuples of typed values (in
+        header order), instead of dicts of strings: integers for _unit_id, _id
+        and _worker_id, a float for _trust, booleans for _golden and
+        _tainted, datetimes for _created_at and _started_at, and unicode for
+        the rest. See crowdflower.decoder.ReportDecoder. Use like:
+
+            for row in job.decode_report(namedtuples=True):
+                print row.unit_id, row.created_at.year, row.sentiment
+
+        If `legend` is True, the job's legend() is requested, so that the
+        values of its CML fields (which have few distinct values) are each
+        decoded only once. `types` maps column names to the type to read them
+        as (one of crowdflower.decoder.CONVERTERS), overriding the defaults.
+
+        If `batch_size` is given, lists of up to that many rows are yielded.
+        The other arguments are the same as for Job.download().
+        '''
+        legend = self.legend() if legend is True else legend
+        if processes is None:
+            members = self._report_members(full=full, filepath=filepath, wait=wait, regenerate=regenerate)
+            return decode_report(members, types=types, legend=legend, namedtuples=namedtuples, batch_size=batch_size)
+        batches = self._parallel_report_batches('tuples', dict(types=types, legend=legend), processes, ordered,
+                                                full=full, filepath=filepath, wait=wait, regenerate=regenerate)
+        rows = self._parallel_rows(batches, types, legend, namedtuples)
+        return rows if batch_size is None else batched(rows, batch_size)
+
+    def _parallel_rows(self, batches, types, legend, namedtuples):
+        # namedtuple classes can't be pickled, so workers send plain tuples
+        Rows = dict()
+        for header, rows in batches:
+            if namedtuples:
+                Row = Rows.get(tuple(header))
+                if Row is None:
+                    Row = Rows[tuple(header)] = ReportDecoder(header, types=types, legend=legend, namedtuples=True).Row
+                rows = map(Row._make, rows)
+            for row in rows:
+                yield row
+
+    def _parallel_report_batches(self, kind, decoder_kwargs, processes, ordered,
+                                 full=True, filepath=None, wait=None, regenerate=False):
+        '''
+        Download the zipped report (to a temporary file, if no `filepath` is
+        given, since the worker processes read it by path) and yield its
+        parsed (header, rows) batches; see crowdflower.parallel.report_batches.
+        '''
+        if regenerate:
+            self._regenerate_before_download('full' if full else 'aggregated')
+        params = dict(full='true' if full else 'false')
+        temporary = None
+        if filepath is None:
+            fd, temporary = mkstemp(prefix='crowdflower-report-', suffix='.zip')
+            os.close(fd)
+        try:
+            zf = self._download_zip(params, filepath=filepath or temporary, wait=wait, revalidate=temporary is None)
+            zf.fp.close()
+            zf.close()
+            for batch in report_batches(filepath or temporary, processes=processes, ordered=ordered, kind=kind,
+                                        decoder_kwargs=decoder_kwargs):
+                yield batch
+        finally:
+            if temporary is not None:
+                os.remove(temporary)
+
+    def judgments_table(self, columns=None, legend=True, types=None, full=True, filepath=None, wait=None,
+                        regenerate=False):
+        '''
+        Read the full report into a column-oriented crowdflower.table.JudgmentsTable,
+        with NumPy arrays for numeric, boolean, and timestamp columns,
+        dictionary-encoded (Categorical) columns for those with few distinct
+        values, and object arrays for the other strings, which takes a small
+        fraction of the memory of job.judgments. Requires NumPy.
+
+        If `columns` is given, only those columns are read. `legend` and
+        `types` are the same as for Job.decode_report(); the job's CML fields
+        are dictionary-encoded. The other arguments are the same as for
+        Job.download().
+        '''
+        legend = self.legend() if legend is True else legend
+        members = self._report_members(full=full, filepath=filepath, wait=wait, regenerate=regenerate)
+        # imported here, since it imports numpy
+        from crowdflower.table import read_table
+        return read_table(members, columns=columns, legend=legend, types=types)
+
+    def aggregate_judgments(self, fields=None, min_trust=None, exclude_workers=None, wait=None):
+        '''
+        Download the full report and aggregate the answers to the given CML
+        `fields` (by default, every field in the job's legend()) for each
+        unit locally; see crowdflower.aggregate.aggregate().
+
+        To recompute with different thresholds, keep the table around instead:
+
+            table = job.judgments_table(columns=['_unit_id', '_worker_id', '_trust', 'sentiment'])
+            strict = aggregate(table, ['sentiment'], min_trust=0.9)
+        '''
+        if fields is None:
+            fields = sorted(self.legend())
+        columns = ['_unit_id', '_worker_id', '_trust'] + list(fields)
+        # the answers are dictionary-encoded, whether or not they're in the legend
+        table = self.judgments_table(columns=columns, legend=False, types=dict.fromkeys(fields, 'category'),
+                                     wait=wait)
+        # fields that no judgment answered are not in the report
+        fields = [field for field in fields if field in table]
+        from crowdflower.aggregate import aggregate
+        return aggregate(table, fields, min_trust=min_trust, exclude_workers=exclude_workers)
+
+    def judgment_store(self, dirpath, rebuild=False, full=True, filepath=None, wait=None, regenerate=False,
+                       processes=None):
+        '''
+        Open the memory-mapped crowdflower.mmapstore.MappedJudgmentStore of
+        this job's full report at `dirpath`, downloading the report and
+        building the store first if it doesn't exist yet, or if `rebuild` (or
+        `regenerate`) is True. Opening an existing store reads nothing but its
+        metadata, and the judgments of a unit or worker are looked up through
+        its indexes:
+
+            store = job.judgment_store('/data/job-%d' % job.id)
+            judgments = store.unit(495781935)
+
+        The other arguments are the same as for Job.download().
+        '''
+        from crowdflower.mmapstore import MappedJudgmentStore
+        if os.path.exists(dirpath) and not (rebuild or regenerate):
+            return MappedJudgmentStore(dirpath)
+        rows = self.download(full=full, filepath=filepath, wait=wait, regenerate=regenerate, processes=processes)
+        return MappedJudgmentStore.build(dirpath, rows)
+
+    def _report_members(self, full=True, filepath=None, wait=None, regenerate=False):
+        '''
+        Download the zipped report (see Job.download()) and yield a file-like
+        object for each CSV file in it, closing the zip file when done.
+        '''
+        if regenerate:
+            self._regenerate_before_download('full' if full else 'aggregated')
+        params = dict(full='true' if full else 'false')
+        zf = self._download_zip(params, filepath=filepath, wait=wait)
+        try:
+            for zipinfo in zf.filelist:
+                yield zf.open(zipinfo)
+        finally:
+            zf.fp.close()
+            zf.close()
+
     @property
     @cacheable()
     def judgments(self):
         return self.download()
 
-    def download_csv(self, filepath, report_type='full'):
+    @cacheable('judgments', stream=True)
+    def iter_judgments(self, wait=None):
+        '''
+        Iterate over the rows of this job's full report, like job.judgments,
+        but without holding them all in memory. On a cache miss, rows are
+        streamed into the cache as they are downloaded; on a hit, they are
+        read back lazily.
+
+        `wait` is passed on to Job.download().
+        '''
+        return self.download(wait=wait)
+
+    def download_csv(self, filepath, report_type='full', wait=None, regenerate=False):
         '''
         Basically the same as job.judgments but without parsing the CSV.
 
@@ -405,25 +848,29 @@ class Job(object):
         * source
         * workset
 
+        `wait` and `regenerate` work the same as in Job.download().
+
         References:
         * https://success.crowdflower.com/hc/en-us/articles/202703425-CrowdFlower-API-Requests-Guide#get_results
         '''
+        if regenerate:
+            self._regenerate_before_download(report_type)
         params = {}
         if report_type is not None:
             params['type'] = report_type
         # even type=json uses the .csv extension. I guess because JSON's values
         # are at least partly separated by commas?
-        req = self._connection.create_request('/jobs/%s.csv' % self.id, method='GET', params=params)
-        res = self._connection.send_request(req)
-        fp = StringIO()
-        fp.write(res.content)
-        zf = zipfile.ZipFile(fp)
-        zipinfo = zf.filelist[0]
-        fsrc = zf.open(zipinfo)
-        with open(filepath, 'w') as fdst:
-            shutil.copyfileobj(fsrc, fdst)
-
-    def regenerate(self, report_type='full'):
+        zf = self._download_zip(params, wait=wait)
+        try:
+            zipinfo = zf.filelist[0]
+            fsrc = zf.open(zipinfo)
+            with open(filepath, 'w') as fdst:
+                shutil.copyfileobj(fsrc, fdst)
+        finally:
+            zf.fp.close()
+            zf.close()
+
+    def regenerate(self, report_type='full', wait=None):
         '''
         Triggers regeneration of a report on the CrowdFlower servers.
 
@@ -433,9 +880,27 @@ class Job(object):
 
         :param report_type: any valid report_type that can be passed to
         download_csv, e.g., 'full', 'aggregated', 'source', etc.
+        :param wait: if given, poll (without downloading the report) for up to
+        this many seconds, until the regenerated report is ready.
         '''
         params = {}
         if report_type is not None:
             params['type'] = report_type
         req = self._connection.create_request('/jobs/%s/regenerate' % self.id, method='POST', params=params)
         self._connection.send_request(req)
+        if wait is not None:
+            # the regenerate POST can return before the server starts
+            # responding with 202s, so don't check right away
+            time.sleep(self.REPORT_BACKOFF['initial'])
+            res = self._report_response(dict(type=report_type) if report_type is not None else {}, wait=wait)
+            res.close()
+
+    def _regenerate_before_download(self, report_type):
+        '''
+        Trigger regeneration of a report that is about to be downloaded. Like
+        regenerate(wait=...), wait a moment first, since the regenerate POST
+        can return before the server starts responding with 202s, and a
+        download right away could get the stale report.
+        '''
+        self.regenerate(report_type)
+        time.sleep(self.REPORT_BACKOFF['initial'])
@@ -0,0 +1,150 @@
+import re
+import random
+import threading
+from collections import defaultdict
+
+
+def endpoint_template(path):
+    '''
+    Replace the IDs in an API path with placeholders, e.g.,
+    '/jobs/123/units/456' becomes '/jobs/{id}/units/{id}' and '/jobs/123.csv'
+    becomes '/jobs/{id}.csv'.
+    '''
+    return re.sub(r'/\d+(?=/|\.|$)', '/{id}', path)
+
+
+def job_id(path):
+    '''
+    Returns the job ID in an API path like '/jobs/123/units', or None.
+    '''
+    match = re.match(r'^/jobs/(\d+)', path)
+    if match is not None:
+        return int(match.group(1))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class _Series(object):
+    '''
+    Counts and totals for one kind of event, and a uniform random sample of
+    at most `sample_size` of their latencies, for percentiles.
+    '''
+    def __init__(self, sample_size):
+        self.sample_size = sample_size
+        self.count = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latencies = []
+
+    def add(self, event):
+        self.count += 1
+        if event.get('error') is not None:
+            self.errors += 1
+        self.request_bytes += event.get('request_bytes') or 0
+        self.response_bytes += event.get('response_bytes') or 0
+        self.retries += event.get('retries') or 0
+        latency = event.get('latency', 0.0)
+        self.latency_total += latency
+        # reservoir sampling
+        if len(self.latencies) < self.sample_size:
+            self.latencies.append(latency)
+        else:
+            index = random.randint(0, self.count - 1)
+            if index < self.sample_size:
+                self.latencies[index] = latency
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return dict(count=self.count, errors=self.errors, retries=self.retries,
+                    request_bytes=self.request_bytes, response_bytes=self.response_bytes,
+                    latency_total=self.latency_total,
+                    latency_p50=percentile(latencies, 0.5), latency_p90=percentile(latencies, 0.9),
+                    latency_p99=percentile(latencies, 0.99), latency_max=latencies[-1] if latencies else None)
+
+
+class Registry(object):
+    '''
+    An in-memory, thread-safe metrics sink. Pass one as a Connection's
+    `metrics`, and then read registry.summary(), or print registry.report():
+
+        registry = Registry()
+        conn = Connection(metrics=registry)
+        ...
+        print registry.report()
+
+    Request events are grouped by method and endpoint template (and totaled
+    per job), and cache events by key family (e.g., 'Job.units') and result.
+    '''
+    def __init__(self, sample_size=10000):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __call__(self, event):
+        with self._lock:
+            if event['type'] == 'request':
+                self._requests[(event['method'], event['endpoint'])].add(event)
+                if event.get('job_id') is not None:
+                    self._jobs[event['job_id']].add(event)
+            elif event['type'] == 'cache':
+                self._caches[(event['family'], event['result'])].add(event)
+
+    def reset(self):
+        with self._lock:
+            self._requests = defaultdict(lambda: _Series(self.sample_size))
+            self._jobs = defaultdict(lambda: _Series(self.sample_size))
+            self._caches = defaultdict(lambda: _Series(self.sample_size))
+
+    def summary(self):
+        '''
+        Returns a dict like:
+
+            {
+                'requests': {('GET', '/jobs/{id}/units'): {'count': 12, 'latency_p50': 0.1, ...}, ...},
+                'jobs': {123: {'count': 14, 'response_bytes': 120034, ...}, ...},
+                'caches': {('Job.units', 'hit'): {'count': 3, ...}, ...},
+            }
+        '''
+        with self._lock:
+            return dict(
+                requests=dict((key, series.summary()) for key, series in self._requests.items()),
+                jobs=dict((key, series.summary()) for key, series in self._jobs.items()),
+                caches=dict((key, series.summary()) for key, series in self._caches.items()),
+            )
+
+    def report(self, top_jobs=10):
+        '''
+        Returns a plain-text table of the summary, with the `top_jobs` jobs
+        that made the most requests.
+        '''
+        summary = self.summary()
+
+        def ms(seconds):
+            return '%.1f' % (seconds * 1000) if seconds is not None else '-'
+
+        lines = ['%-8s %-32s %7s %6s %7s %10s %8s %8s %8s' % (
+            'method', 'endpoint', 'count', 'errors', 'retries', 'bytes in', 'p50 ms', 'p90 ms', 'p99 ms')]
+        for (method, endpoint), stats in sorted(summary['requests'].items(), key=lambda item: -item[1]['count']):
+            lines.append('%-8s %-32s %7d %6d %7d %10d %8s %8s %8s' % (
+                method, endpoint, stats['count'], stats['errors'], stats['retries'], stats['response_bytes'],
+                ms(stats['latency_p50']), ms(stats['latency_p90']), ms(stats['latency_p99'])))
+        lines.append('')
+        lines.append('%-41s %7s %8s %8s %8s' % ('cache', 'count', 'p50 ms', 'p90 ms', 'p99 ms'))
+        for (family, result), stats in sorted(summary['caches'].items()):
+            lines.append('%-41s %7d %8s %8s %8s' % (
+                '%s %s' % (family, result), stats['count'],
+                ms(stats['latency_p50']), ms(stats['latency_p90']), ms(stats['latency_p99'])))
+        lines.append('')
+        lines.append('%-12s %7s %10s %10s' % ('job', 'count', 'bytes in', 'seconds'))
+        jobs = sorted(summary['jobs'].items(), key=lambda item: -item[1]['count'])[:top_jobs]
+        for job_id, stats in jobs:
+            lines.append('%-12s %7d %10d %10.2f' % (job_id, stats['count'], stats['response_bytes'], stats['latency_total']))
+        return '\n'.join(lines)
@@ -0,0 +1,334 @@
+import os
+import sys
+import csv
+import json
+import mmap
+import shutil
+import struct
+import bisect
+import calendar
+import tempfile
+from datetime import datetime
+
+from crowdflower import logger
+from crowdflower.decoder import infer_types, datetimes
+
+
+# struct format (native byte order, standard sizes) and missing value of
+# each column type; strings are stored as ids into the string heap
+FORMATS = {
+    'integer': ('=q', -1),
+    'float': ('=d', float('nan')),
+    'boolean': ('=b', -1),
+    'datetime': ('=q', -2 ** 63),
+    'string': ('=i', -1),
+}
+# columns with offset indexes
+INDEXED_COLUMNS = ('_unit_id', '_worker_id')
+# number of values buffered per column while writing
+WRITE_BUFFER = 65536
+
+
+def _column_type(inferred):
+    return inferred if inferred in ('integer', 'float', 'boolean', 'datetime') else 'string'
+
+
+def _mmap(filepath):
+    with open(filepath, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            # empty files can't be mapped
+            return ''
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _MappedArray(object):
+    '''
+    A read-only sequence of fixed-width values in a memory-mapped file, read
+    with struct.unpack_from, so that nothing is loaded until it is accessed
+    (and bisect works on it directly).
+    '''
+    def __init__(self, buf, fmt):
+        self.buf = buf
+        self.fmt = fmt
+        self.itemsize = struct.calcsize(fmt)
+
+    def __len__(self):
+        return len(self.buf) // self.itemsize
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return struct.unpack_from(self.fmt, self.buf, index * self.itemsize)[0]
+
+    def slice(self, start, stop):
+        count = stop - start
+        return struct.unpack_from('=%d%s' % (count, self.fmt[1:]), self.buf, start * self.itemsize)
+
+
+class _Writer(object):
+    # buffers values and appends them to a file of fixed-width values
+    def __init__(self, filepath, fmt):
+        self.fp = open(filepath, 'wb')
+        self.fmt = fmt[1:]
+        self.values = []
+
+    def append(self, value):
+        self.values.append(value)
+        if len(self.values) >= WRITE_BUFFER:
+            self.flush()
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def flush(self):
+        if self.values:
+            self.fp.write(struct.pack('=%d%s' % (len(self.values), self.fmt), *self.values))
+            self.values = []
+
+    def close(self):
+        self.flush()
+        self.fp.close()
+
+
+class MappedJudgmentStore(object):
+    '''
+    A read-only, on-disk store of a job's judgments, in the directory
+    `dirpath`, which is memory-mapped, so opening it takes no time
+    regardless of its size, and only the pages that are read are loaded:
+
+        store = MappedJudgmentStore.build('/tmp/job-123', job.download())
+        store = MappedJudgmentStore('/tmp/job-123')   # later
+        for judgment in store.unit(495781935):
+            print judgment['_worker_id'], judgment['sentiment']
+        print len(store.worker(31337))
+        trusts = store.column('_trust')
+
+    Each column is a file of fixed-width values: integers (_unit_id, _id,
+    _worker_id), floats (_trust), booleans (_golden, _tainted), and
+    timestamps (_created_at, _started_at, as seconds since the epoch), and
+    every other column holds ids into a heap of distinct UTF-8 strings.
+    The judgments of each _unit_id and _worker_id are found in O(log n +
+    result) time through prebuilt indexes: the sorted distinct keys, and
+    the row numbers of each key's judgments.
+
+    Rows are returned as dicts of typed values (see crowdflower.decoder):
+    ints, floats, bools, datetimes, and unicode, or None if missing.
+    '''
+    VERSION = 1
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        with open(os.path.join(dirpath, 'meta.json')) as fp:
+            self.meta = json.load(fp)
+        if self.meta['byteorder'] != sys.byteorder:
+            raise ValueError('%s was written on a %s-endian machine' % (dirpath, self.meta['byteorder']))
+        self.column_names = [column['name'] for column in self.meta['columns']]
+        self.types = dict((column['name'], column['type']) for column in self.meta['columns'])
+        self._columns = dict()
+        for position, column in enumerate(self.meta['columns']):
+            buf = _mmap(os.path.join(dirpath, 'column.%d' % position))
+            self._columns[column['name']] = _MappedArray(buf, FORMATS[column['type']][0])
+        self._heap = _mmap(os.path.join(dirpath, 'strings.heap'))
+        self._string_offsets = _MappedArray(_mmap(os.path.join(dirpath, 'strings.offsets')), '=q')
+        self._indexes = dict()
+        for name in self.meta['indexes']:
+            self._indexes[name] = tuple(_MappedArray(_mmap(os.path.join(dirpath, 'index.%s.%s' % (name, part))), '=q')
+                                        for part in ('keys', 'starts', 'rows'))
+
+    def __repr__(self):
+        return '<{:} of {:} judgments at {:}>'.format(self.__class__.__name__, len(self), self.dirpath)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self.row(index)
+
+    @classmethod
+    def build(cls, dirpath, rows):
+        '''
+        Write the `rows` (dicts of strings, like Job.download() yields) into
+        a new store at `dirpath` (replacing any existing one, once the new
+        one is complete), and return it, opened.
+        '''
+        parent = os.path.dirname(os.path.abspath(dirpath))
+        tmpdir = tempfile.mkdtemp(prefix='.crowdflower-store-', dir=parent)
+        try:
+            cls._write(tmpdir, rows)
+            if os.path.exists(dirpath):
+                shutil.rmtree(dirpath)
+            os.rename(tmpdir, dirpath)
+        except:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        return cls(dirpath)
+
+    @classmethod
+    def from_csv(cls, dirpath, filepath):
+        '''
+        Build a store at `dirpath` from a full report CSV file, e.g., from
+        Job.download_csv().
+        '''
+        with open(filepath, 'rb') as fp:
+            rows = ({key: value.decode('utf8') for key, value in row.items()} for row in csv.DictReader(fp))
+            return cls.build(dirpath, rows)
+
+    @classmethod
+    def _write(cls, dirpath, rows):
+        columns = None
+        writers = None
+        converters = None
+        strings = dict()
+        heap = open(os.path.join(dirpath, 'strings.heap'), 'wb')
+        string_offsets = _Writer(os.path.join(dirpath, 'strings.offsets'), '=q')
+        string_offsets.append(0)
+        heap_size = [0]
+
+        def string_id(value):
+            id = strings.get(value)
+            if id is None:
+                id = strings[value] = len(strings)
+                encoded = value.encode('utf8')
+                heap.write(encoded)
+                heap_size[0] += len(encoded)
+                string_offsets.append(heap_size[0])
+            return id
+
+        def converter(column_type):
+            missing = FORMATS[column_type][1]
+            if column_type == 'integer':
+                return lambda value: int(value) if value else missing
+            if column_type == 'float':
+                return lambda value: float(value) if value else missing
+            if column_type == 'boolean':
+                return lambda value: {'true': 1, 'false': 0}.get(value, missing)
+            if column_type == 'datetime':
+                to_datetime = datetimes()
+                return lambda value: calendar.timegm(to_datetime(value).timetuple()) if value else missing
+            return lambda value: string_id(value) if value is not None else missing
+
+        count = 0
+        keys = dict((name, []) for name in INDEXED_COLUMNS)
+        try:
+            for row in rows:
+                if columns is None:
+                    inferred = infer_types(list(row))
+                    columns = [dict(name=name, type=_column_type(inferred[name])) for name in sorted(row)]
+                    writers = [_Writer(os.path.join(dirpath, 'column.%d' % position), FORMATS[column['type']][0])
+                               for position, column in enumerate(columns)]
+                    converters = [converter(column['type']) for column in columns]
+                    keys = dict((name, []) for name in INDEXED_COLUMNS if name in row)
+                for column, writer, convert in zip(columns, writers, converters):
+                    writer.append(convert(row.get(column['name'])))
+                for name, values in keys.items():
+                    values.append(int(row[name]) if row.get(name) else -1)
+                count += 1
+        finally:
+            for writer in writers or []:
+                writer.close()
+            string_offsets.close()
+            heap.close()
+
+        for name, values in keys.items():
+            cls._write_index(dirpath, name, values)
+        meta = dict(version=cls.VERSION, count=count, byteorder=sys.byteorder, columns=columns or [],
+                    indexes=sorted(keys))
+        with open(os.path.join(dirpath, 'meta.json'), 'w') as fp:
+            json.dump(meta, fp, indent=2)
+        logger.info('Wrote %d judgments and %d distinct strings to %s', count, len(strings), dirpath)
+
+    @staticmethod
+    def _write_index(dirpath, name, values):
+        # the row numbers, grouped by key, and each key's range of them
+        order = sorted(xrange(len(values)), key=values.__getitem__)
+        distinct = []
+        starts = []
+        for position, row in enumerate(order):
+            if not distinct or values[row] != distinct[-1]:
+                distinct.append(values[row])
+                starts.append(position)
+        starts.append(len(order))
+        for part, data in (('keys', distinct), ('starts', starts), ('rows', order)):
+            writer = _Writer(os.path.join(dirpath, 'index.%s.%s' % (name, part)), '=q')
+            writer.extend(data)
+            writer.close()
+
+    def _string(self, id):
+        if id < 0:
+            return None
+        start, end = self._string_offsets.slice(id, id + 2)
+        return self._heap[start:end].decode('utf8')
+
+    def _value(self, name, index):
+        column_type = self.types[name]
+        value = self._columns[name][index]
+        if column_type == 'string':
+            return self._string(value)
+        if column_type == 'float':
+            return None if value != value else value
+        if value == FORMATS[column_type][1]:
+            return None
+        if column_type == 'boolean':
+            return bool(value)
+        if column_type == 'datetime':
+            return datetime.utcfromtimestamp(value)
+        return value
+
+    def row(self, index):
+        '''
+        Returns the judgment at row `index` as a dict.
+        '''
+        return dict((name, self._value(name, index)) for name in self.column_names)
+
+    def column(self, name):
+        '''
+        Iterate over the values of one column, in row order, reading only
+        that column's file.
+        '''
+        for index in xrange(len(self)):
+            yield self._value(name, index)
+
+    def array(self, name):
+        '''
+        Returns a numeric column as a NumPy array backed by the mapped file,
+        without copying it (raw values: missing integers are -1, and missing
+        timestamps are the minimum int64). Requires NumPy.
+        '''
+        import numpy as np
+        column_type = self.types[name]
+        if column_type == 'string':
+            raise ValueError('%s is a string column' % name)
+        column = self._columns[name]
+        if not len(column):
+            return np.array([], dtype=column.fmt)
+        return np.frombuffer(column.buf, dtype=column.fmt)
+
+    def rows(self, name, key):
+        '''
+        Returns the row numbers of the judgments whose indexed column `name`
+        (_unit_id or _worker_id) equals `key`.
+        '''
+        if name not in self._indexes:
+            raise KeyError('%s is not indexed' % name)
+        keys, starts, rows = self._indexes[name]
+        position = bisect.bisect_left(keys, key)
+        if position == len(keys) or keys[position] != key:
+            return ()
+        start, stop = starts.slice(position, position + 2)
+        return rows.slice(start, stop)
+
+    def unit(self, unit_id):
+        '''
+        Returns the judgments of the given unit, as dicts.
+        '''
+        return [self.row(index) for index in self.rows('_unit_id', int(unit_id))]
+
+    def worker(self, worker_id):
+        '''
+        Returns the judgments by the given worker, as dicts.
+        '''
+        return [self.row(index) for index in self.rows('_worker_id', int(worker_id))]
@@ -0,0 +1,133 @@
+import time
+import heapq
+
+from crowdflower import logger
+from crowdflower import pool
+from crowdflower.cache import keyfunc
+from crowdflower.exception import CrowdFlowerError
+
+
+# job states after which a job's status will not change
+FINAL_STATES = ('finished', 'canceled')
+
+
+def job_status(conn, job_id):
+    '''
+    Fetch the ping counts and (fresh) properties of a job, capturing any
+    error rather than raising it. Returns a dict like:
+
+        {
+            'id': 123,
+            'ping': {'needed_judgments': 40, ...},
+            'properties': {'state': 'running', ...},
+            'error': None,
+            'checked_at': 1430000000.0,
+        }
+
+    The properties are written to the cache as Job[id].properties.
+    '''
+    status = dict(id=job_id, ping=None, properties=None, error=None)
+    try:
+        job = conn.job(job_id)
+        status['ping'] = job.ping()
+        status['properties'] = conn.request('/jobs/%s' % job_id)
+        conn._cache.put(keyfunc(job, 'properties'), status['properties'])
+    except Exception, exc:
+        status['error'] = exc
+    status['checked_at'] = time.time()
+    return status
+
+
+def is_final(status):
+    properties = status['properties'] or dict()
+    return properties.get('state') in FINAL_STATES
+
+
+def is_permanent_error(exc):
+    '''
+    Whether retrying the request that raised `exc` cannot succeed: a 4xx
+    response (e.g., a deleted job's 404, or a revoked key's 401), other than
+    408 Request Timeout and 429 Too Many Requests.
+    '''
+    if not isinstance(exc, CrowdFlowerError) or exc.response is None:
+        return False
+    return 400 <= exc.response.status_code < 500 and exc.response.status_code not in (408, 429)
+
+
+def next_interval(status, last_status, last_interval, min_interval, max_interval):
+    '''
+    Choose how many seconds to wait before polling a job again, given its
+    current and previous statuses and the previous interval.
+
+    If `needed_judgments` is falling, poll about twice before the job is
+    expected to need none; otherwise, back off by doubling the interval.
+    '''
+    if last_status is None:
+        return min_interval
+    try:
+        needed = status['ping']['needed_judgments']
+        last_needed = last_status['ping']['needed_judgments']
+    except (KeyError, TypeError):
+        needed = last_needed = None
+    elapsed = status['checked_at'] - last_status['checked_at']
+    if needed is not None and last_needed is not None and needed < last_needed and elapsed > 0:
+        rate = (last_needed - needed) / elapsed
+        interval = needed / rate / 2
+    else:
+        interval = last_interval * 2
+    return max(min_interval, min(max_interval, interval))
+
+
+def watch(conn, job_ids, threads=8, min_interval=30.0, max_interval=900.0, max_errors=5):
+    '''
+    Poll the statuses (see job_status) of the given jobs concurrently,
+    yielding each as it arrives, and re-polling each job until it reaches a
+    final state (see FINAL_STATES), at intervals chosen by next_interval.
+
+    A job is given up on after an error that retrying cannot fix (see
+    is_permanent_error), or after `max_errors` consecutive errors of any
+    kind, so that this always ends.
+
+    Each status has an extra 'interval' key: the number of seconds until the
+    job is polled again, or None if it will not be.
+    '''
+    # heap of (due time, job id)
+    schedule = [(0, job_id) for job_id in job_ids]
+    heapq.heapify(schedule)
+    last_statuses = dict()
+    intervals = dict()
+    # consecutive errors of each job
+    errors = dict()
+    while schedule:
+        delay = schedule[0][0] - time.time()
+        if delay > 0:
+            logger.debug('Next job status poll in %.1f seconds', delay)
+            time.sleep(delay)
+        now = time.time()
+        due = []
+        while schedule and schedule[0][0] <= now:
+            due.append(heapq.heappop(schedule)[1])
+        for status in pool.imap_unordered(lambda job_id: job_status(conn, job_id), due, threads=threads):
+            job_id = status['id']
+            if status['error'] is not None:
+                errors[job_id] = errors.get(job_id, 0) + 1
+            else:
+                errors.pop(job_id, None)
+            if is_final(status):
+                status['interval'] = None
+            elif status['error'] is not None and (is_permanent_error(status['error']) or
+                                                  errors[job_id] >= max_errors):
+                logger.warning('Giving up on watching Job[%s] after %d errors: %r', job_id, errors[job_id],
+                            status['error'])
+                status['interval'] = None
+            else:
+                if status['error'] is not None:
+                    # back off, and keep comparing against the last good status
+                    status['interval'] = min(max_interval, max(min_interval, intervals.get(job_id, 0) * 2))
+                else:
+                    status['interval'] = next_interval(status, last_statuses.get(job_id),
+                                                       intervals.get(job_id, min_interval), min_interval, max_interval)
+                    last_statuses[job_id] = status
+                intervals[job_id] = status['interval']
+                heapq.heappush(schedule, (status['checked_at'] + status['interval'], job_id))
+            yield status
@@ -0,0 +1,139 @@
+import os
+import csv
+import shutil
+import zipfile
+import tempfile
+from cStringIO import StringIO
+from multiprocessing import cpu_count
+
+from crowdflower import logger
+from crowdflower import pool
+from crowdflower.decoder import ReportDecoder
+
+
+# bytes of CSV per task
+CHUNK_BYTES = 8 * 1024 * 1024
+# bytes read at a time when looking for row boundaries
+SCAN_BYTES = 1024 * 1024
+
+
+def row_boundaries(fp, chunk_bytes=CHUNK_BYTES):
+    '''
+    Find the offsets in a CSV file at which to split it into chunks of about
+    `chunk_bytes`, at row boundaries: newlines that are not inside a quoted
+    value, i.e., that follow an even number of double quotes (escaped quotes
+    are doubled, so they don't change the parity).
+
+    Returns a list of offsets, starting with the end of the header row and
+    ending with the end of the file.
+    '''
+    offsets = []
+    # the first boundary is the end of the header
+    target = 0
+    position = 0
+    # the number of quotes before position + start
+    quotes = 0
+    while True:
+        block = fp.read(SCAN_BYTES)
+        if not block:
+            break
+        start = 0
+        while True:
+            newline = block.find('\n', max(start, target - position))
+            if newline == -1:
+                break
+            quotes += block.count('"', start, newline)
+            start = newline + 1
+            if quotes % 2 == 0:
+                offsets.append(position + start)
+                target = position + start + chunk_bytes
+        quotes += block.count('"', start)
+        position += len(block)
+    if not offsets or offsets[-1] < position:
+        offsets.append(position)
+    return offsets
+
+
+def _parse(fp, header, kind, decoder_kwargs):
+    reader = csv.reader(fp)
+    if header is None:
+        header = next(reader, None)
+        if header is None:
+            return header, []
+    if kind == 'dicts':
+        rows = [dict(zip(header, [value.decode('utf8') for value in row])) for row in reader]
+    elif kind == 'lists':
+        rows = [[value.decode('utf8') for value in row] for row in reader]
+    else:
+        rows = list(ReportDecoder(header, **decoder_kwargs).decode_rows(reader))
+    return header, rows
+
+
+def parse_task(task):
+    '''
+    Parse one task (in a worker process): either a whole zip member,
+    ('member', zip_path, member_name, ...), or a byte range of an extracted
+    CSV file, ('range', csv_path, header, start, end, ...).
+
+    Returns the header and a list of rows, each a dict (like Job.download()
+    yields), a list of unicode values, or a tuple (see
+    crowdflower.decoder.ReportDecoder), depending on the task's kind.
+    '''
+    if task[0] == 'member':
+        _, zip_path, member_name, kind, decoder_kwargs = task
+        with zipfile.ZipFile(zip_path) as zf:
+            # read it all at once; ZipExtFile.readline is slow
+            return _parse(StringIO(zf.read(member_name)), None, kind, decoder_kwargs)
+    _, csv_path, header, start, end, kind, decoder_kwargs = task
+    with open(csv_path, 'rb') as fp:
+        fp.seek(start)
+        return _parse(StringIO(fp.read(end - start)), header, kind, decoder_kwargs)
+
+
+def report_batches(zip_path, processes=None, ordered=True, kind='dicts', decoder_kwargs=None,
+                   chunk_bytes=CHUNK_BYTES):
+    '''
+    Parse the CSV members of the zipped report at `zip_path` in a pool of
+    `processes` processes (defaults to the number of CPUs), and yield
+    (header, rows) batches, each from one member, or from one chunk of about
+    `chunk_bytes` of a larger member, which is extracted to a temporary file
+    and split at row boundaries (see row_boundaries). If `ordered` is False,
+    batches are yielded as soon as they are ready, rather than in order. At
+    most twice as many batches as processes are parsed ahead of the one
+    being consumed.
+
+    `kind` and `decoder_kwargs` determine the type of rows (see parse_task).
+    '''
+    decoder_kwargs = decoder_kwargs or dict()
+    processes = processes or cpu_count()
+    tempdir = tempfile.mkdtemp(prefix='crowdflower-report-')
+    batches = None
+    try:
+        tasks = []
+        with zipfile.ZipFile(zip_path) as zf:
+            for zipinfo in zf.filelist:
+                if zipinfo.file_size <= chunk_bytes:
+                    tasks.append(('member', zip_path, zipinfo.filename, kind, decoder_kwargs))
+                    continue
+                csv_path = os.path.join(tempdir, '%d.csv' % len(tasks))
+                with zf.open(zipinfo) as source, open(csv_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, SCAN_BYTES)
+                with open(csv_path, 'rb') as fp:
+                    offsets = row_boundaries(fp, chunk_bytes)
+                    fp.seek(0)
+                    header = next(csv.reader(StringIO(fp.read(offsets[0]))), None)
+                if header is None:
+                    continue
+                for start, end in zip(offsets, offsets[1:]):
+                    tasks.append(('range', csv_path, header, start, end, kind, decoder_kwargs))
+        logger.debug('Parsing %s in %d tasks', zip_path, len(tasks))
+        imap = pool.imap if ordered else pool.imap_unordered
+        batches = imap(parse_task, tasks, threads=processes, processes=True)
+        for header, rows in batches:
+            if header is not None:
+                yield header, rows
+    finally:
+        if batches is not None:
+            # stop the workers before removing their files
+            batches.close()
+        shutil.rmtree(tempdir, ignore_errors=True)
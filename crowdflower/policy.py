@@ -0,0 +1,154 @@
+import time
+import threading
+from email.utils import parsedate_tz, mktime_tz
+from requests.exceptions import ConnectionError, Timeout
+
+from crowdflower import logger
+from crowdflower import backoff
+
+
+class TokenBucket(object):
+    '''
+    A thread-safe token bucket rate limiter, allowing bursts of up to
+    `capacity` requests, refilled at `rate` requests per second.
+
+    A single instance can be shared by any number of threads and policies
+    (and thus Connections), to limit their combined request rate.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{:} at {:}/s, up to {:}>'.format(self.__class__.__name__, self.rate, self.capacity)
+
+    def acquire(self):
+        '''
+        Take a token from the bucket, blocking until one is available.
+
+        Returns the number of seconds spent waiting.
+        '''
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def retry_after(res):
+    '''
+    Parse the Retry-After header of a response (either a number of seconds,
+    or an HTTP date) into a number of seconds, or None if it's missing or
+    unreadable.
+    '''
+    value = res.headers.get('Retry-After')
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+
+def response_validators(res):
+    '''
+    Returns a dict of the response's cache validators, with 'etag' and / or
+    'last_modified' keys, depending on which headers it has.
+    '''
+    validators = dict()
+    if 'ETag' in res.headers:
+        validators['etag'] = res.headers['ETag']
+    if 'Last-Modified' in res.headers:
+        validators['last_modified'] = res.headers['Last-Modified']
+    return validators
+
+
+class RequestPolicy(object):
+    '''
+    Every request that a Connection makes is sent through its policy's send()
+    method. This default policy simply sends the request once.
+    '''
+    def send(self, session, prepared_req, stream=False):
+        return session.send(prepared_req, stream=stream)
+
+
+class RetryPolicy(RequestPolicy):
+    '''
+    Sends requests through an optional TokenBucket `limiter`, and retries
+    requests that use idempotent methods up to `retries` times when they fail
+    with a connection error or one of the `statuses` codes, waiting as long as
+    the response's Retry-After header says to, or else backing off
+    exponentially (see crowdflower.backoff.delays, with `backoff` kwargs).
+
+    The counters `throttled` (requests delayed by the limiter, or rejected
+    with a 429) and `retried` (attempts after the first) are thread-safe.
+    The number of retries of each request is set as `retries` on its final
+    response (or exception).
+    Share a policy between Connections to pool their limits and counters:
+
+        policy = RetryPolicy(limiter=TokenBucket(rate=5, capacity=10))
+        conn_a = Connection(api_key=KEY_A, policy=policy)
+        conn_b = Connection(api_key=KEY_B, policy=policy)
+    '''
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    def __init__(self, limiter=None, retries=3, statuses=(429, 500, 502, 503, 504),
+                 backoff=dict(initial=1.0, maximum=30.0, factor=2.0, jitter=0.5)):
+        self.limiter = limiter
+        self.retries = retries
+        self.statuses = statuses
+        self.backoff = backoff
+        self.throttled = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{:} throttled={:} retried={:}>'.format(self.__class__.__name__, self.throttled, self.retried)
+
+    def _count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def send(self, session, prepared_req, stream=False):
+        retryable = prepared_req.method in self.IDEMPOTENT_METHODS
+        delays = backoff.delays(**self.backoff)
+        attempt = 0
+        while True:
+            if self.limiter is not None and self.limiter.acquire() > 0:
+                self._count('throttled')
+            try:
+                res = session.send(prepared_req, stream=stream)
+            except (ConnectionError, Timeout), exc:
+                if not retryable or attempt >= self.retries:
+                    exc.retries = attempt
+                    raise
+                delay = next(delays)
+                logger.info('%r on %s %s; retrying in %.1f seconds', exc, prepared_req.method, prepared_req.path_url, delay)
+            else:
+                if res.status_code == 429:
+                    self._count('throttled')
+                if res.status_code not in self.statuses or not retryable or attempt >= self.retries:
+                    res.retries = attempt
+                    return res
+                delay = retry_after(res)
+                if delay is None:
+                    delay = next(delays)
+                res.close()
+                logger.info('%d %s on %s %s; retrying in %.1f seconds', res.status_code, res.reason,
+                            prepared_req.method, prepared_req.path_url, delay)
+            attempt += 1
+            self._count('retried')
+            time.sleep(delay)
@@ -0,0 +1,70 @@
+import sys
+from Queue import Queue
+from collections import deque
+from multiprocessing.pool import Pool, ThreadPool
+
+
+def imap(func, iterable, threads=4, window=None, processes=False):
+    '''
+    Like itertools.imap(func, iterable), but calls `func` on up to `threads`
+    items at once, in a thread pool, or if `processes` is True, a process
+    pool (in which case `func`, the items, and the results must be picklable).
+
+    Results are yielded in the same order as `iterable`. At most `window`
+    calls (defaults to twice the number of threads) are submitted ahead of
+    the result being yielded, so a slow consumer does not cause all of the
+    results to pile up in memory.
+    '''
+    if window is None:
+        window = 2 * threads
+    pool = Pool(threads) if processes else ThreadPool(threads)
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def _call(func, item, processes):
+    try:
+        return func(item), None
+    except Exception:
+        exc_type, exc_value, traceback = sys.exc_info()
+        # tracebacks can't be pickled
+        return None, (exc_type, exc_value, None if processes else traceback)
+
+
+def imap_unordered(func, iterable, threads=4, window=None, processes=False):
+    '''
+    Like imap(), but yields each result as soon as it is ready, rather than
+    in the order of `iterable`.
+    '''
+    if window is None:
+        window = 2 * threads
+    pool = Pool(threads) if processes else ThreadPool(threads)
+    done = Queue()
+
+    def result():
+        value, exc_info = done.get()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return value
+
+    pending = 0
+    try:
+        for item in iterable:
+            pool.apply_async(_call, (func, item, processes), callback=done.put)
+            pending += 1
+            if pending >= window:
+                yield result()
+                pending -= 1
+        while pending:
+            yield result()
+            pending -= 1
+    finally:
+        pool.terminate()
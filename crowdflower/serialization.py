@@ -1,3 +1,7 @@
+import json
+from urllib import quote_plus
+
+
 def rails(value, prefix=''):
     if isinstance(value, list):
         for subvalue in value:
@@ -15,3 +19,78 @@ def rails_params(params):
     for root, value in params.items():
         for pair in rails(value, prefix=root):
             yield pair
+
+
+def _form_quote(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return quote_plus(value)
+
+
+def rails_form(params):
+    '''
+    Encode nested `params` as an application/x-www-form-urlencoded string of
+    Rails-style parameters, like urlencode(list(rails_params(params))), but
+    in a single pass, quoting each key segment only once, rather than every
+    leaf's full key. None values are skipped, like Requests does with query
+    parameters.
+    '''
+    fields = []
+    # depth-first, like rails_params, but without recursion, and with the
+    # prefixes already quoted
+    stack = [(_form_quote(root), value) for root, value in reversed(params.items())]
+    while stack:
+        prefix, value = stack.pop()
+        if isinstance(value, list):
+            prefix += '%5B%5D'
+            stack.extend((prefix, subvalue) for subvalue in reversed(value))
+        elif isinstance(value, dict):
+            stack.extend((prefix + '%5B' + _form_quote(subkey) + '%5D', subvalue)
+                         for subkey, subvalue in reversed(value.items()))
+        elif value is not None:
+            fields.append(prefix + '=' + _form_quote(value))
+    return '&'.join(fields)
+
+
+def ndjson(items, chunk_size=64 * 1024):
+    '''
+    Serialize `items` as newline-separated JSON, lazily, as a generator of
+    strings of about `chunk_size` bytes (which Requests will send with
+    chunked transfer encoding).
+    '''
+    chunk = []
+    chunk_bytes = 0
+    separator = ''
+    for item in items:
+        line = separator + json.dumps(item)
+        separator = '\n'
+        chunk.append(line)
+        chunk_bytes += len(line)
+        if chunk_bytes >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            chunk_bytes = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def ndjson_batches(items, max_bytes):
+    '''
+    Serialize `items` to JSON and group them into lists of JSON strings, each
+    of which will be at most `max_bytes` long when joined with newlines (unless
+    a single item is longer than that, in which case it gets its own batch).
+    '''
+    batch = []
+    batch_bytes = 0
+    for item in items:
+        line = json.dumps(item)
+        if batch and batch_bytes + len(line) > max_bytes:
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(line)
+        batch_bytes += len(line) + 1
+    if batch:
+        yield batch
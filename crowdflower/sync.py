@@ -0,0 +1,140 @@
+import json
+import time
+import sqlite3
+import hashlib
+
+from crowdflower import logger
+from crowdflower.table import parse_timestamp
+
+
+class JudgmentStore(object):
+    '''
+    A persistent local store of judgments, in a SQLite database at `filepath`,
+    kept up to date with JudgmentStore.sync(job). Use like:
+
+        store = JudgmentStore('judgments.sqlite')
+        checkpoint = store.checkpoint(job.id)
+        store.sync(job)
+        for judgment in store.judgments(job.id, since=checkpoint):
+            print judgment['_id'], judgment['_unit_id']
+
+    The CrowdFlower API can only send the full report, so sync() first checks
+    job.ping() and skips the download entirely if the judgment counts have
+    not changed since the last sync. When it does download, only new and
+    changed rows (by _id) are written, and they are tagged with a new
+    checkpoint number, so that consumers can process just those rows.
+    Stored rows created at or before the high-water mark (the latest
+    _created_at) of the last sync are not even compared, unless the ping
+    shows that judgments were tainted since then, which is how old
+    judgments change.
+
+    A JudgmentStore must only be used from the thread that created it.
+    '''
+    # counts from job.ping() which indicate that the report has changed
+    PING_FIELDS = ('all_judgments', 'tainted_judgments', 'needed_judgments')
+
+    def __init__(self, filepath='/tmp/crowdflower-judgments.sqlite'):
+        self.filepath = filepath
+        self._conn = sqlite3.connect(filepath)
+        with self._conn as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS judgments (job_id INTEGER NOT NULL, id INTEGER NOT NULL, '
+                         'unit_id INTEGER, created_at INTEGER, checkpoint INTEGER NOT NULL, digest TEXT NOT NULL, '
+                         'data TEXT NOT NULL, PRIMARY KEY (job_id, id))')
+            conn.execute('CREATE INDEX IF NOT EXISTS judgments_checkpoint ON judgments (job_id, checkpoint)')
+            conn.execute('CREATE TABLE IF NOT EXISTS syncs (job_id INTEGER NOT NULL, checkpoint INTEGER NOT NULL, '
+                         'synced_at REAL NOT NULL, ping TEXT NOT NULL, high_water INTEGER, '
+                         'PRIMARY KEY (job_id, checkpoint))')
+
+    def __repr__(self):
+        return '<{:} at {:}>'.format(self.__class__.__name__, self.filepath)
+
+    def _last_sync(self, job_id):
+        return self._conn.execute('SELECT checkpoint, ping, high_water FROM syncs WHERE job_id = ? '
+                                  'ORDER BY checkpoint DESC LIMIT 1', (job_id,)).fetchone()
+
+    def checkpoint(self, job_id):
+        '''
+        Returns the latest checkpoint number for the given job, or 0 if it has
+        never been synced.
+        '''
+        last_sync = self._last_sync(job_id)
+        return last_sync[0] if last_sync is not None else 0
+
+    def high_water(self, job_id):
+        '''
+        Returns the latest _created_at (seconds since the epoch) of all stored
+        judgments for the given job, or None.
+        '''
+        last_sync = self._last_sync(job_id)
+        return last_sync[2] if last_sync is not None else None
+
+    def sync(self, job, force=False, wait=None):
+        '''
+        Bring the store up to date with the job's full report, downloading it
+        only if job.ping() shows that it has changed (or if `force` is True).
+        `wait` is passed on to Job.download().
+
+        Returns a dict like:
+
+            {'checkpoint': 3, 'downloaded': True, 'inserted': 120, 'updated': 2, 'skipped': 5000}
+
+        where 'skipped' counts the stored rows that were not compared, because
+        they are older than the high-water mark (see JudgmentStore).
+        '''
+        ping = job.ping()
+        ping_counts = json.dumps([ping.get(field) for field in self.PING_FIELDS])
+        last_sync = self._last_sync(job.id)
+        if last_sync is not None and last_sync[1] == ping_counts and not force:
+            logger.info('Judgments for Job[%s] have not changed since checkpoint %d', job.id, last_sync[0])
+            return dict(checkpoint=last_sync[0], downloaded=False, inserted=0, updated=0, skipped=0)
+
+        checkpoint = last_sync[0] + 1 if last_sync is not None else 1
+        high_water = last_sync[2] if last_sync is not None else None
+        # stored rows up to the last high-water mark only need comparing if
+        # judgments have been tainted since
+        tainted = self.PING_FIELDS.index('tainted_judgments')
+        last_high_water = None
+        if not force and last_sync is not None and json.loads(last_sync[1])[tainted] == ping.get('tainted_judgments'):
+            last_high_water = high_water
+        digests = dict(self._conn.execute('SELECT id, digest FROM judgments WHERE job_id = ?', (job.id,)))
+        inserted = updated = skipped = 0
+        with self._conn as conn:
+            for row in job.download(wait=wait):
+                judgment_id = int(row['_id'])
+                old_digest = digests.get(judgment_id)
+                created_at = parse_timestamp(row['_created_at']) if row.get('_created_at') else None
+                if (old_digest is not None and last_high_water is not None and created_at is not None and
+                        created_at <= last_high_water):
+                    skipped += 1
+                    continue
+                data = json.dumps(row, sort_keys=True)
+                digest = hashlib.sha1(data.encode('utf8')).hexdigest()
+                if old_digest == digest:
+                    continue
+                if created_at is not None and (high_water is None or created_at > high_water):
+                    high_water = created_at
+                conn.execute('INSERT OR REPLACE INTO judgments (job_id, id, unit_id, created_at, checkpoint, digest, data) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (job.id, judgment_id, int(row['_unit_id']), created_at, checkpoint, digest, data))
+                if old_digest is None:
+                    inserted += 1
+                else:
+                    updated += 1
+            conn.execute('INSERT INTO syncs (job_id, checkpoint, synced_at, ping, high_water) VALUES (?, ?, ?, ?, ?)',
+                         (job.id, checkpoint, time.time(), ping_counts, high_water))
+        # the job's cached judgments are stale now
+        job._cache_flush('judgments')
+        logger.info('Synced Job[%s] to checkpoint %d: %d new, %d changed, %d skipped judgments', job.id, checkpoint,
+                    inserted, updated, skipped)
+        return dict(checkpoint=checkpoint, downloaded=True, inserted=inserted, updated=updated, skipped=skipped)
+
+    def judgments(self, job_id, since=0):
+        '''
+        Iterate over the stored judgments (dicts, like Job.download() yields)
+        for the given job that were added or changed after checkpoint `since`,
+        in the order they were synced.
+        '''
+        cursor = self._conn.execute('SELECT data FROM judgments WHERE job_id = ? AND checkpoint > ? '
+                                    'ORDER BY checkpoint, id', (job_id, since))
+        for (data,) in cursor:
+            yield json.loads(data)
@@ -0,0 +1,208 @@
+import csv
+import calendar
+from array import array
+from collections import OrderedDict
+
+# column types are inferred like decode_report's: only columns with few
+# distinct values are read as dictionary-encoded strings (see Categorical)
+from crowdflower.decoder import infer_types
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def parse_timestamp(value):
+    '''
+    Parse a CrowdFlower 'm/d/yyyy hh:mm:ss' timestamp (UTC) into seconds
+    since the epoch.
+    '''
+    date, time = value.split(' ')
+    month, day, year = date.split('/')
+    hour, minute, second = time.split(':')
+    return calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+
+
+class Categorical(object):
+    '''
+    A dictionary-encoded column of strings: `categories` is a list of the
+    distinct (unicode) values, and `codes` is an integer NumPy array of
+    indices into it, one per row.
+    '''
+    __slots__ = ('codes', 'categories')
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    def __repr__(self):
+        return '<{:} of {:} values in {:} categories>'.format(self.__class__.__name__, len(self.codes), len(self.categories))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.categories[self.codes[index]]
+
+    def decode(self):
+        '''
+        Returns a NumPy object array of the values, one per row.
+        '''
+        return np.array(self.categories, dtype=object)[self.codes]
+
+
+class _IntegerColumn(object):
+    # missing values are read as -1
+    def __init__(self):
+        self.values = array('l')
+
+    def append(self, value):
+        self.values.append(int(value) if value else -1)
+
+    def finish(self):
+        return np.array(self.values, dtype=np.int64)
+
+
+class _FloatColumn(object):
+    # missing values are read as NaN
+    def __init__(self):
+        self.values = array('d')
+
+    def append(self, value):
+        self.values.append(float(value) if value else float('nan'))
+
+    def finish(self):
+        return np.array(self.values, dtype=np.float64)
+
+
+class _BooleanColumn(object):
+    def __init__(self):
+        self.values = array('b')
+
+    def append(self, value):
+        self.values.append(value == 'true')
+
+    def finish(self):
+        return np.array(self.values, dtype=np.bool_)
+
+
+class _TimestampColumn(object):
+    # missing values are read as NaT
+    MISSING = np.iinfo(np.int64).min if np is not None else None
+
+    def __init__(self):
+        self.values = array('l')
+
+    def append(self, value):
+        self.values.append(parse_timestamp(value) if value else self.MISSING)
+
+    def finish(self):
+        return np.array(self.values, dtype=np.int64).view('datetime64[s]')
+
+
+class _CategoricalColumn(object):
+    def __init__(self):
+        self.codes = array('l')
+        self.index = dict()
+
+    def append(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.index)
+        self.codes.append(code)
+
+    def finish(self):
+        categories = [None] * len(self.index)
+        for value, code in self.index.items():
+            # only the distinct values need to be decoded
+            categories[code] = value.decode('utf8')
+        return Categorical(np.array(self.codes, dtype=np.int32), categories)
+
+
+class _TextColumn(object):
+    def __init__(self):
+        self.values = []
+
+    def append(self, value):
+        self.values.append(value.decode('utf8'))
+
+    def finish(self):
+        values = np.empty(len(self.values), dtype=object)
+        values[:] = self.values
+        return values
+
+
+# column builders for each type of crowdflower.decoder.infer_types
+_COLUMN_BUILDERS = {
+    'integer': _IntegerColumn,
+    'float': _FloatColumn,
+    'boolean': _BooleanColumn,
+    'datetime': _TimestampColumn,
+    'category': _CategoricalColumn,
+    'text': _TextColumn,
+    'raw': _TextColumn,
+}
+
+
+class JudgmentsTable(object):
+    '''
+    A column-oriented table of judgments, built by Job.judgments_table().
+
+    table[name] returns the column called `name`: a NumPy array for the
+    integer (_unit_id, _id, _worker_id), float (_trust), boolean (_golden,
+    _tainted), and datetime64 (_created_at, _started_at) columns, a
+    Categorical for the columns with few distinct values (_channel,
+    _country, etc., and the job's CML fields), or a NumPy object array of
+    unicode strings for the rest (like the units' data, or _ip).
+    '''
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __repr__(self):
+        return '<{:} with {:} rows of {:}>'.format(self.__class__.__name__, len(self), ', '.join(self.columns))
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+
+def read_table(files, columns=None, legend=None, types=None):
+    '''
+    Build a JudgmentsTable from an iterable of CSV files (file-like objects
+    of UTF-8 encoded bytes), all with the same header. If `columns` is given,
+    only those columns are read; values in the others are never converted.
+
+    Column types are inferred from the header, the job's `legend`, and
+    `types`, as in crowdflower.decoder.infer_types.
+    '''
+    if np is None:
+        raise ImportError('JudgmentsTable requires numpy; install it with `pip install numpy`')
+    builders = None
+    for fp in files:
+        reader = csv.reader(fp)
+        header = next(reader, None)
+        if header is None:
+            continue
+        if builders is None:
+            names = header if columns is None else [name for name in columns if name in header]
+            inferred = infer_types(names, legend=legend, types=types)
+            builders = OrderedDict((name, _COLUMN_BUILDERS[inferred[name]]()) for name in names)
+        appenders = [(header.index(name), builder.append) for name, builder in builders.items()]
+        for row in reader:
+            for index, append in appenders:
+                append(row[index])
+    if builders is None:
+        builders = OrderedDict()
+    return JudgmentsTable(OrderedDict((name, builder.finish()) for name, builder in builders.items()))
@@ -1,16 +1,256 @@
-class Unit(object):
-    '''
-    Read / Write attributes
-        job_id
-        missed_count
-        difficulty
-        state
-        data
-        agreement
-
-    Read-only attributes
-        updated_at
-        created_at
-        judgments_count
-        id
+import threading
+from collections import Mapping
+
+
+class Schema(object):
+    '''
+    The names of a job's custom fields (e.g., 'text', 'sentiment'), shared by
+    all of its records, which store their values in a tuple in the same
+    order, instead of in a dict each. New fields are appended as they are
+    seen, so a record's tuple may be shorter than the schema.
+
+    Field names are interned, and so are the values of the `shared` fields,
+    which have few distinct values (like '_channel' or '_country'), so that
+    millions of records hold references to the same few strings.
+    '''
+    def __init__(self, fields=(), shared=()):
+        self.fields = []
+        self.index = dict()
+        self.shared = frozenset(shared)
+        self._values = dict()
+        self._lock = threading.Lock()
+        for field in fields:
+            self.add(field)
+
+    def __repr__(self):
+        return '<{:} of {:} fields>'.format(self.__class__.__name__, len(self.fields))
+
+    def __getstate__(self):
+        return dict(fields=self.fields, shared=self.shared)
+
+    def __setstate__(self, state):
+        self.__init__(state['fields'], state['shared'])
+
+    def add(self, field):
+        '''
+        Returns the position of `field`, adding it to the end if it's new.
+        '''
+        position = self.index.get(field)
+        if position is None:
+            with self._lock:
+                position = self.index.get(field)
+                if position is None:
+                    position = len(self.fields)
+                    self.fields.append(intern(field) if isinstance(field, str) else field)
+                    self.index[field] = position
+        return position
+
+    def intern_value(self, value):
+        return self._values.setdefault(value, value)
+
+
+class Record(object):
+    '''
+    A compact replacement for a dict: the fixed METADATA fields are stored in
+    slots, and the rest in a tuple ordered by a shared Schema. Records
+    support the dict interface for reading (record['text'],
+    record.get('text'), record.items(), etc.) and item assignment, and
+    dict(record) or record.to_dict() converts one back into a dict.
+    '''
+    __slots__ = ('_schema', '_values')
+    METADATA = ()
+    # metadata fields with few distinct values, which the Schema interns
+    SHARED = ()
+    # like dicts, records are mutable (see __setitem__), and so unhashable
+    __hash__ = None
+
+    def __init__(self, schema, values=(), **metadata):
+        # metadata slots are left unset if not given
+        self._schema = schema
+        self._values = tuple(values)
+        for field, value in metadata.items():
+            setattr(self, field, value)
+
+    @classmethod
+    def new_schema(cls, fields=()):
+        return Schema(fields, shared=cls.SHARED)
+
+    @classmethod
+    def from_dict(cls, row, schema):
+        '''
+        Create a record from a dict like Job.download() or Job.units yields.
+        '''
+        record = cls(schema)
+        values = []
+        for key, value in row.items():
+            if key in cls.METADATA:
+                if key in schema.shared:
+                    value = schema.intern_value(value)
+                setattr(record, key, value)
+            else:
+                position = schema.add(key)
+                if position >= len(values):
+                    values.extend([_MISSING] * (position + 1 - len(values)))
+                values[position] = value
+        record._values = tuple(values)
+        return record
+
+    @classmethod
+    def from_rows(cls, header, rows, schema):
+        '''
+        Create records from lists of values in the order of the `header`
+        field names, e.g., from a csv.reader.
+        '''
+        metadata = [(index, field, field in schema.shared) for index, field in enumerate(header)
+                    if field in cls.METADATA]
+        custom = [(index, schema.add(field)) for index, field in enumerate(header) if field not in cls.METADATA]
+        width = max([position + 1 for _, position in custom] or [0])
+        intern_value = schema.intern_value
+        for row in rows:
+            if len(row) < len(header):
+                row = list(row) + [None] * (len(header) - len(row))
+            record = cls(schema)
+            for index, field, shared in metadata:
+                setattr(record, field, intern_value(row[index]) if shared else row[index])
+            values = [_MISSING] * width
+            for index, position in custom:
+                values[position] = row[index]
+            record._values = tuple(values)
+            yield record
+
+    def __repr__(self):
+        return '<{:} {!r}>'.format(self.__class__.__name__, self.to_dict())
+
+    def __getstate__(self):
+        return (self._schema, self._values, [getattr(self, field, None) for field in self.METADATA])
+
+    def __setstate__(self, state):
+        self._schema, self._values, metadata = state
+        for field, value in zip(self.METADATA, metadata):
+            if value is not None:
+                setattr(self, field, value)
+
+    def __getitem__(self, key):
+        if key in self.METADATA:
+            # unset slots are missing fields
+            value = getattr(self, key, None)
+            if value is not None:
+                return value
+        else:
+            position = self._schema.index.get(key)
+            if position is not None and position < len(self._values):
+                value = self._values[position]
+                if value is not _MISSING:
+                    return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.METADATA:
+            setattr(self, key, value)
+        else:
+            position = self._schema.add(key)
+            values = list(self._values)
+            if position >= len(values):
+                values.extend([_MISSING] * (position + 1 - len(values)))
+            values[position] = value
+            self._values = tuple(values)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        for field in self.METADATA:
+            if getattr(self, field, None) is not None:
+                yield field
+        fields = self._schema.fields
+        for position, value in enumerate(self._values):
+            if value is not _MISSING:
+                yield fields[position]
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+
+    def to_dict(self):
+        return dict(self.iteritems())
+
+
+# the dict interface is implemented directly, since inheriting from Mapping
+# (which has no __slots__) would give every record a __dict__
+Mapping.register(Record)
+
+
+class _Missing(object):
+    '''
+    A placeholder for fields that a record does not have.
+    '''
+    def __repr__(self):
+        return '<missing>'
+
+    def __reduce__(self):
+        # unpickle as the singleton
+        return '_MISSING'
+
+_MISSING = _Missing()
+
+
+class Unit(Record):
+    '''
+    A unit, as Job.iter_units(records=True) yields: the '_unit_id' and the
+    unit's data fields.
+
+    (The full unit resource, from /jobs/{job_id}/units/{unit_id}, also has
+    job_id, missed_count, difficulty, state, data, agreement, updated_at,
+    created_at, judgments_count, and id.)
+    '''
+    __slots__ = ('_unit_id',)
+    METADATA = ('_unit_id',)
+
+
+class Judgment(Record):
+    '''
+    A row of a job's full report, as Job.download(records=True) yields: the
+    '_'-prefixed judgment attributes (see Job.download()) and the unit's
+    data and the contributor's answers.
     '''
+    __slots__ = ('_unit_id', '_created_at', '_golden', '_canary', '_id', '_missed', '_started_at', '_tainted',
+                 '_channel', '_trust', '_worker_id', '_country', '_region', '_city', '_ip')
+    METADATA = __slots__
+    SHARED = ('_golden', '_canary', '_missed', '_tainted', '_channel', '_country', '_region', '_city')
@@ -0,0 +1,238 @@
+import re
+import json
+import time
+import hashlib
+import calendar
+import threading
+import urlparse
+from Queue import Queue
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+from crowdflower import logger
+
+
+# judgment attributes that are columns (prefixed with '_') in the full report
+REPORT_ATTRIBUTES = ['created_at', 'golden', 'id', 'missed', 'started_at', 'tainted', 'channel', 'trust',
+                     'worker_id', 'country', 'region', 'city', 'ip']
+
+
+def report_timestamp(value):
+    '''
+    Convert an ISO 8601 timestamp, like the webhook payloads have, e.g.,
+    '2015-06-01T10:00:00+02:00', into the UTC 'm/d/yyyy hh:mm:ss' format of
+    the CSV reports.
+    '''
+    match = re.match(r'^(\d+)-(\d+)-(\d+)[T ](\d+):(\d+):(\d+)(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?$', value)
+    if match is None:
+        return value
+    year, month, day, hour, minute, second = map(int, match.groups()[:6])
+    seconds = calendar.timegm((year, month, day, hour, minute, second))
+    offset = match.group(7)
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '-' else 1
+        offset = offset[1:].replace(':', '')
+        seconds -= sign * (int(offset[:2]) * 3600 + int(offset[2:]) * 60)
+    utc = time.gmtime(seconds)
+    return '%d/%d/%d %02d:%02d:%02d' % (utc.tm_mon, utc.tm_mday, utc.tm_year, utc.tm_hour, utc.tm_min, utc.tm_sec)
+
+
+def report_value(value):
+    '''
+    Format a JSON value like it appears in the CSV reports, as unicode (like
+    Job.download() yields).
+    '''
+    if value is None:
+        return u''
+    if isinstance(value, bool):
+        return u'true' if value else u'false'
+    if isinstance(value, list):
+        # multiple answers (e.g., checkboxes) are newline-separated
+        return u'\n'.join(report_value(item) for item in value)
+    if isinstance(value, dict):
+        return unicode(json.dumps(value))
+    return unicode(value)
+
+
+def judgment_row(judgment):
+    '''
+    Convert a judgment from a webhook payload into a row like those that
+    Job.download() yields: the unit's data, the judgment's answers, and
+    the judgment's attributes as '_'-prefixed columns, all as strings.
+    '''
+    row = dict()
+    for key, value in (judgment.get('unit_data') or dict()).items():
+        row[key] = report_value(value)
+    for key, value in (judgment.get('data') or dict()).items():
+        row[key] = report_value(value)
+    row['_unit_id'] = report_value(judgment.get('unit_id'))
+    row['_canary'] = u''
+    for key in REPORT_ATTRIBUTES:
+        value = judgment.get(key)
+        if key in ('created_at', 'started_at') and value:
+            value = report_timestamp(value)
+        row['_' + key] = report_value(value)
+    return row
+
+
+def payload_judgments(signal, payload):
+    '''
+    Returns the judgments in a webhook payload (already parsed from JSON): a
+    list of judgments for the 'new_judgments' signal, or a unit with its
+    judgments for 'unit_complete'. Other signals have no judgments.
+    '''
+    if signal == 'new_judgments':
+        return payload if isinstance(payload, list) else [payload]
+    if signal == 'unit_complete':
+        return (payload.get('results') or dict()).get('judgments') or []
+    return []
+
+
+def parse_payload(signal, payload):
+    '''
+    Returns the rows (see judgment_row) of the judgments in a webhook payload.
+    '''
+    return [judgment_row(judgment) for judgment in payload_judgments(signal, payload)]
+
+
+def signature(payload, api_key):
+    '''
+    CrowdFlower signs each webhook request with the SHA1 hex digest of the
+    (JSON string) payload concatenated with the account's API key.
+    '''
+    return hashlib.sha1(payload + api_key).hexdigest()
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug('Webhook request: ' + format, *args)
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        form = urlparse.parse_qs(body)
+        try:
+            signal = form['signal'][0]
+            payload = form['payload'][0]
+            parsed = json.loads(payload)
+        except (KeyError, ValueError), exc:
+            logger.warning('Ignoring malformed webhook request: %r', exc)
+            return self._respond(400, json.dumps({'error': 'malformed request'}))
+        receiver = self.server.receiver
+        if receiver.api_key is not None:
+            if form.get('signature', [''])[0] != signature(payload, receiver.api_key):
+                logger.warning('Ignoring webhook request with a bad signature')
+                return self._respond(403, json.dumps({'error': 'bad signature'}))
+        receiver.receive(signal, parsed)
+        self._respond(200, json.dumps({}))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WebhookReceiver(object):
+    '''
+    An embeddable HTTP server that receives CrowdFlower webhook requests,
+    and turns the judgments in them into rows like those Job.download()
+    yields. Use like:
+
+        with WebhookReceiver(port=8000, connection=conn) as receiver:
+            receiver.configure(job, 'http://my.public.host:8000/')
+            for row in receiver:
+                print row['_unit_id'], row['_worker_id']
+
+    Each row is passed to `callback` (called from the request's thread), if
+    given, or else put on the `queue` (a Queue.Queue of at most `queue_size`
+    rows). When the queue is full, requests block until the consumer catches
+    up, so that CrowdFlower holds off (and retries) rather than rows piling
+    up in memory.
+
+    Only the judgments of the given `signals` are delivered: configure()
+    turns on 'new_judgments', which sends each judgment once, as it arrives;
+    'unit_complete' resends all of a unit's judgments when it is complete.
+
+    If a `connection` is given, requests are checked against its API key's
+    signature, and the cached judgments of jobs with new rows are flushed.
+    '''
+    def __init__(self, host='', port=0, callback=None, queue_size=10000, connection=None,
+                 signals=('new_judgments',)):
+        self.callback = callback
+        self.queue = Queue(queue_size)
+        self.connection = connection
+        self.api_key = connection.api_key if connection is not None else None
+        self.signals = signals
+        self._server = _ThreadingHTTPServer((host, port), WebhookRequestHandler)
+        self._server.receiver = self
+        self._thread = None
+
+    def __repr__(self):
+        return '<{:} at {:}>'.format(self.__class__.__name__, self.url)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            yield self.queue.get()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def configure(self, job, url=None):
+        '''
+        Point the job's webhook at this receiver (or at `url`, e.g., the
+        public address of a proxy in front of it), and have CrowdFlower send
+        each new judgment.
+
+        If the receiver is bound to a wildcard address (like the default,
+        host=''), its own url is not one that CrowdFlower can reach, so `url`
+        must be given.
+        '''
+        if url is None:
+            host = self._server.server_address[0]
+            if host in ('', '0.0.0.0', '::'):
+                raise ValueError('%r is listening on all interfaces; pass the public url to configure()' % self)
+            url = self.url
+        return job.update({'webhook_uri': url, 'send_judgments_webhook': 'true'})
+
+    def receive(self, signal, payload):
+        '''
+        Deliver the rows from a parsed webhook payload (see parse_payload).
+        '''
+        if signal not in self.signals:
+            logger.info('Ignoring webhook signal "%s"', signal)
+            return
+        judgments = payload_judgments(signal, payload)
+        if self.connection is not None:
+            for job_id in set(judgment.get('job_id') for judgment in judgments):
+                if job_id is not None:
+                    # the job's cached judgments are stale now
+                    self.connection.job(job_id)._cache_flush('judgments')
+        for judgment in judgments:
+            row = judgment_row(judgment)
+            if self.callback is not None:
+                self.callback(row)
+            else:
+                self.queue.put(row)
@@ -0,0 +1,117 @@
+import json
+import time
+import threading
+
+from crowdflower import logger
+
+
+class UnitWriter(object):
+    '''
+    Buffers units and uploads them to a job in batches, as a single
+    /jobs/{job_id}/upload request per batch, instead of one request per unit
+    (like Job.upload_unit does). Use like:
+
+        with job.unit_writer(max_units=500, max_delay=10) as writer:
+            for unit in stream:
+                writer.upload_unit(unit)
+        print writer.errors
+
+    The buffer is flushed when it holds `max_units` units or `max_bytes` bytes
+    of JSON, when its oldest unit has waited `max_delay` seconds (if given),
+    when flush() is called, and when the writer is closed.
+
+    Errors do not propagate out of flush(); each failed batch is appended to
+    `errors` as a (units, exception) pair, where units is the list of JSON
+    strings in that batch. The API response for each successful batch is
+    appended to `responses`.
+    '''
+    def __init__(self, job, max_units=1000, max_bytes=4 * 1024 * 1024, max_delay=None):
+        self.job = job
+        self.max_units = max_units
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.responses = []
+        self.errors = []
+
+        # _lock guards the buffer; _flush_lock serializes flushes, so that
+        # batches are sent in order, while new units can still be buffered
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_started = None
+
+        self._closed = threading.Event()
+        self._thread = None
+        if max_delay is not None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __repr__(self):
+        return '<{:} for Job[{:}] with {:} buffered units>'.format(self.__class__.__name__, self.job.id, len(self._buffer))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def upload_unit(self, unit):
+        '''
+        Add a single unit (dict) to the buffer, flushing it if it is full.
+        '''
+        line = json.dumps(unit)
+        with self._lock:
+            if not self._buffer:
+                self._buffer_started = time.time()
+            self._buffer.append(line)
+            self._buffer_bytes += len(line) + 1
+            full = len(self._buffer) >= self.max_units or self._buffer_bytes >= self.max_bytes
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''
+        Upload all buffered units as one batch, and reset the job's cached
+        units. Returns the API response, or None if the buffer was empty or
+        the upload failed.
+        '''
+        with self._flush_lock:
+            with self._lock:
+                batch = self._buffer
+                self._buffer = []
+                self._buffer_bytes = 0
+                self._buffer_started = None
+            if not batch:
+                return None
+
+            logger.debug('Flushing batch of %d units to Job[%s]', len(batch), self.job.id)
+            try:
+                res = self.job._upload('\n'.join(batch))
+            except Exception, exc:
+                logger.error('Failed to upload batch of %d units to Job[%s]: %r', len(batch), self.job.id, exc)
+                self.errors.append((batch, exc))
+                return None
+            else:
+                self.responses.append(res)
+                return res
+            finally:
+                # reset cached units
+                self.job._cache_flush('units')
+
+    def close(self):
+        '''
+        Stop the background flushing thread (if any), and flush the buffer.
+        '''
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        # check a few times per max_delay period whether the oldest unit is overdue
+        while not self._closed.wait(self.max_delay / 4.0):
+            started = self._buffer_started
+            if started is not None and time.time() - started >= self.max_delay:
+                self.flush()
@@ -1,8 +1,13 @@
+import re
 from setuptools import setup, find_packages
 
+# read the version without importing the package (and its dependencies)
+with open('crowdflower/__init__.py') as fp:
+    version = re.search(r"^__version__ = '([^']+)'", fp.read(), re.M).group(1)
+
 setup(
     name='crowdflower',
-    version='0.1.5',
+    version=version,
     author='Christopher Brown',
     author_email='io@henrian.com',
     url='https://github.com/peoplepattern/crowdflower',
@@ -20,4 +25,7 @@ setup(
     install_requires=[
         'requests>=2.0.0',
     ],
+    extras_require={
+        'table': ['numpy'],
+    },
 )